@@ -0,0 +1,97 @@
+import asyncio, io, os, sys
+from asgiref.wsgi import WsgiToAsgi
+from server import app, extraction_pool, metadata_store, renewal
+
+# ASGI entry point serving the same routes as server.py. Async views run directly on the worker's shared
+# event loop, so caches, single-flight calls and background tasks are shared; sync views go through WsgiToAsgi.
+wsgi_fallback = WsgiToAsgi(app)
+
+def build_environ(scope: dict, body: bytes) -> dict:
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin-1').upper().replace('-', '_'), value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'): environ[name] = value
+        else:
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+async def read_body(receive) -> bytes:
+    body, more_body = b'', True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+async def dispatch(environ: dict):
+    with app.request_context(environ) as context:
+        try:
+            rv = app.preprocess_request()
+            if rv is None: rv = await app.view_functions[context.request.endpoint](**context.request.view_args)
+        except Exception as e:
+            try:
+                rv = app.handle_user_exception(e)
+            except Exception as e:
+                rv = app.handle_exception(e)
+        response = app.process_response(app.make_response(rv))
+        return response.status_code, response.headers.to_wsgi_list(), response.get_data()
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            renewal.stop()
+            extraction_pool.shutdown()
+            metadata_store.flush_hits()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan': return await lifespan(receive, send)
+    if scope['type'] != 'http': return await wsgi_fallback(scope, receive, send)
+
+    # Peek at the route without consuming the body; anything that isn't an async view (templates,
+    # streaming responses, redirects, 404s) is left to Flask's own WSGI handling
+    probe = build_environ(scope, b'')
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(probe).match()
+    except Exception:
+        return await wsgi_fallback(scope, receive, send)
+    if not asyncio.iscoroutinefunction(app.view_functions.get(endpoint)):
+        return await wsgi_fallback(scope, receive, send)
+
+    environ = build_environ(scope, await read_body(receive))
+    status, headers, body = await dispatch(environ)
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+# Main entry point, e.g. `python asgi.py` or `uvicorn asgi:application --port 5000 --workers 2`
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("asgi:application", port=int(os.environ.get('PORT', 5000)), workers=int(os.environ.get('WEB_CONCURRENCY', 2)))
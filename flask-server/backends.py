@@ -0,0 +1,195 @@
+import json, os, queue, socket, sqlite3, threading, time, zlib
+from typing import Any, Optional, Tuple
+from urllib.parse import urlparse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Entries above this size are zlib compressed; the first byte of every entry says which form follows
+COMPRESS_SIZE = 1024
+
+def pack(value: Any, expires_at: float) -> bytes:
+    data = orjson.dumps([expires_at, value]) if orjson else json.dumps([expires_at, value], separators=(',', ':')).encode('utf-8')
+    if len(data) >= COMPRESS_SIZE: return b'z' + zlib.compress(data, 6)
+    return b'j' + data
+
+def unpack(data: bytes) -> Tuple[Any, float]:
+    body = zlib.decompress(data[1:]) if data[:1] == b'z' else data[1:]
+    expires_at, value = orjson.loads(body) if orjson else json.loads(body)
+    return value, expires_at
+
+
+class CacheBackend:
+    """Key/value store shared by every replica, holding packed entries that expire after their ttl."""
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {'backend': type(self).__name__}
+
+
+class MemoryBackend(CacheBackend):
+    """In-process backend; shares nothing between replicas, but keeps the interface usable without a server."""
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] <= time.time():
+                del self._entries[key]
+                entry = None
+        return entry[0] if entry else None
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {'backend': 'memory', 'entries': len(self._entries)}
+
+
+class SQLiteBackend(CacheBackend):
+    """One SQLite file (WAL) shared by replicas on the same host."""
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)')
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._db.execute('SELECT value FROM cache WHERE key = ? AND expires_at > ?', (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)', (key, value, now + ttl))
+            self._writes += 1
+            if self._writes % SQLiteBackend.PURGE_EVERY == 0: self._db.execute('DELETE FROM cache WHERE expires_at <= ?', (now,))
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db.execute('SELECT COUNT(*) FROM cache WHERE expires_at > ?', (time.time(),)).fetchone()[0]
+        return {'backend': 'sqlite', 'path': self.path, 'entries': entries}
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend(CacheBackend):
+    """Speaks just enough RESP (GET, SET PX, DEL) for any Redis compatible server, without the redis package.
+
+    Cache errors are never fatal: a failing server is treated as a miss and skipped for `retry_after` seconds."""
+    def __init__(self, host: str = 'localhost', port: int = 6379, db: int = 0, password: str = None, prefix: str = 'ytm:',
+                 timeout: float = 0.5, retry_after: float = 5):
+        self.host, self.port, self.db, self.password = host, port, db, password
+        self.prefix = prefix
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._idle = queue.LifoQueue()
+        self._down_until = 0.0
+        self.errors = 0
+
+    @staticmethod
+    def encode_command(*args) -> bytes:
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes): arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    @staticmethod
+    def read_reply(reader) -> Any:
+        line = reader.readline()
+        if not line.endswith(b'\r\n'): raise ConnectionError('connection closed by server')
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+': return body
+        if kind == b'-': raise RedisError(body.decode('utf-8', 'replace'))
+        if kind == b':': return int(body)
+        if kind == b'$':
+            length = int(body)
+            return None if length < 0 else reader.read(length + 2)[:-2]
+        if kind == b'*':
+            length = int(body)
+            return None if length < 0 else [RedisBackend.read_reply(reader) for _ in range(length)]
+        raise RedisError(f'unexpected reply {line!r}')
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = (sock, sock.makefile('rb'))
+        if self.password: self._send(connection, 'AUTH', self.password)
+        if self.db: self._send(connection, 'SELECT', self.db)
+        return connection
+
+    def _send(self, connection, *args) -> Any:
+        connection[0].sendall(RedisBackend.encode_command(*args))
+        return RedisBackend.read_reply(connection[1])
+
+    def _command(self, *args) -> Any:
+        if time.monotonic() < self._down_until: return None
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = None
+        try:
+            connection = connection or self._connect()
+            reply = self._send(connection, *args)
+        except (OSError, RedisError) as e:
+            if connection: connection[0].close()
+            self.errors += 1
+            self._down_until = time.monotonic() + self.retry_after
+            print("Error: ", e)
+            return None
+        self._idle.put(connection)
+        return reply
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._command('GET', self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._command('SET', self.prefix + key, value, 'PX', max(1, int(ttl * 1000)))
+
+    def delete(self, key: str) -> None:
+        self._command('DEL', self.prefix + key)
+
+    def stats(self) -> dict:
+        return {'backend': 'redis', 'address': f'{self.host}:{self.port}/{self.db}', 'errors': self.errors, 'up': time.monotonic() >= self._down_until}
+
+
+def from_url(url: str = None) -> Optional[CacheBackend]:
+    """memory://, sqlite:///path/to/cache.db or redis://[:password@]host[:port][/db]; None keeps caches process local."""
+    url = url if url is not None else os.environ.get('CACHE_BACKEND')
+    if not url: return None
+    parsed = urlparse(url)
+    if parsed.scheme == 'memory': return MemoryBackend()
+    if parsed.scheme == 'sqlite': return SQLiteBackend(parsed.path)
+    if parsed.scheme == 'redis':
+        db = int(parsed.path.strip('/') or 0)
+        return RedisBackend(parsed.hostname or 'localhost', parsed.port or 6379, db, parsed.password)
+    raise ValueError(f'Unknown cache backend "{url}"')
@@ -0,0 +1,166 @@
+import copy, hashlib, json, os, random, socketserver, sys, threading, time, types
+from typing import Dict, List
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures.json')
+
+class UpstreamError(Exception):
+    pass
+
+
+class LatencyModel:
+    """Log-normal latency around a median, with an independent failure probability."""
+    def __init__(self, median_ms: float, sigma: float = 0.5, failure_rate: float = 0.0, seed: int = None):
+        self.median = median_ms / 1000
+        self.sigma = sigma
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self, name: str) -> None:
+        with self._lock:
+            delay = self.median * self._random.lognormvariate(0, self.sigma) if self.median else 0
+            failed = self._random.random() < self.failure_rate
+        time.sleep(delay)
+        if failed: raise UpstreamError(f'injected {name} failure')
+
+
+def _salted_id(salt: str, original: str, length: int = 11) -> str:
+    return hashlib.sha1(f'{salt}:{original}'.encode()).hexdigest()[:length]
+
+def _variant(tracks: List[Dict], salt: str, size: int = None) -> List[Dict]:
+    # Repeat the fixture tracks up to `size`, giving every (salt, position) its own videoId
+    size = size or len(tracks)
+    result = []
+    for i in range(size):
+        track = copy.deepcopy(tracks[i % len(tracks)])
+        track['videoId'] = _salted_id(salt, f"{track['videoId']}:{i}")
+        track['title'] = f"{track['title']} ({salt[:6]}/{i})"
+        result.append(track)
+    return result
+
+
+class FakeYTMusic:
+    """Drop-in for ytmusicapi.YTMusic answering from fixtures.json: hand-written responses in ytmusicapi's shape, not recordings."""
+    fixtures = None
+    latency = LatencyModel(0)
+    playlist_size = 150
+
+    def __init__(self, *args, **kwargs):
+        if FakeYTMusic.fixtures is None:
+            with open(FIXTURES_PATH) as f: FakeYTMusic.fixtures = json.load(f)
+
+    def search(self, query: str, filter: str = None, ignore_spelling: bool = False, **kwargs):
+        FakeYTMusic.latency.wait('search')
+        if filter == 'albums':
+            results = copy.deepcopy(self.fixtures['search_albums'])
+            for album in results: album['browseId'] = 'MPREb_' + _salted_id(query, album['browseId'])
+            return results
+        return _variant(self.fixtures['search_songs'], f'search:{query}')
+
+    def get_watch_playlist(self, videoId: str = None, radio: bool = False, **kwargs):
+        FakeYTMusic.latency.wait('get_watch_playlist')
+        watch = copy.deepcopy(self.fixtures['watch_playlist'])
+        watch['tracks'] = _variant(watch['tracks'], f'radio:{videoId}')
+        watch['tracks'][0]['videoId'] = videoId
+        return watch
+
+    def get_album(self, browseId: str, **kwargs):
+        FakeYTMusic.latency.wait('get_album')
+        album = copy.deepcopy(self.fixtures['album'])
+        album['tracks'] = _variant(album['tracks'], f'album:{browseId}')
+        return album
+
+    def get_playlist(self, playlistId: str, limit: int = 100, **kwargs):
+        FakeYTMusic.latency.wait('get_playlist')
+        playlist = copy.deepcopy(self.fixtures['playlist'])
+        size = FakeYTMusic.playlist_size if limit is None else min(FakeYTMusic.playlist_size, max(limit, 100))
+        playlist['id'] = playlistId
+        playlist['trackCount'] = FakeYTMusic.playlist_size
+        playlist['tracks'] = _variant(playlist['tracks'], f'playlist:{playlistId}', size)
+        return playlist
+
+
+class FakeExtractor:
+    """Stands in for yt-dlp: sleeps like an extraction and returns a googlevideo-shaped url."""
+    def __init__(self, latency: LatencyModel, url_lifetime: float = 6 * 3600):
+        self.latency = latency
+        self.url_lifetime = url_lifetime
+
+    def __call__(self, video_id: str) -> str:
+        self.latency.wait('extract')
+        expire = int(time.time() + self.url_lifetime)
+        return f'https://rr1---sn-fake.googlevideo.com/videoplayback?expire={expire}&id={video_id}&itag=140&mime=audio%2Fmp4'
+
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    """Local stand-in for a Redis server: GET, SET (EX/PX), DEL, PING, SELECT and AUTH over RESP, kept in a dict."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0):
+        super().__init__(('127.0.0.1', port), FakeRedisHandler)
+        self.data = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f'redis://127.0.0.1:{self.server_address[1]}/0'
+
+    def start(self) -> 'FakeRedis':
+        threading.Thread(target=self.serve_forever, name='fake-redis', daemon=True).start()
+        return self
+
+    def execute(self, command: list) -> bytes:
+        name = command[0].upper()
+        with self.lock:
+            if name == b'GET':
+                entry = self.data.get(command[1])
+                if entry and entry[1] is not None and entry[1] <= time.time():
+                    del self.data[command[1]]
+                    entry = None
+                return b'$-1\r\n' if entry is None else b'$%d\r\n%s\r\n' % (len(entry[0]), entry[0])
+            if name == b'SET':
+                expires_at = None
+                options = [option.upper() for option in command[3:]]
+                if b'PX' in options: expires_at = time.time() + int(command[3 + options.index(b'PX') + 1]) / 1000
+                if b'EX' in options: expires_at = time.time() + int(command[3 + options.index(b'EX') + 1])
+                self.data[command[1]] = (command[2], expires_at)
+                return b'+OK\r\n'
+            if name == b'DEL':
+                return b':%d\r\n' % sum(1 for key in command[1:] if self.data.pop(key, None) is not None)
+        if name == b'PING': return b'+PONG\r\n'
+        if name in (b'SELECT', b'AUTH'): return b'+OK\r\n'
+        return b'-ERR unknown command\r\n'
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line: return
+            command = []
+            for _ in range(int(line[1:-2])):
+                length = int(self.rfile.readline()[1:-2])
+                command.append(self.rfile.read(length + 2)[:-2])
+            self.wfile.write(self.server.execute(command))
+
+
+def install_extractor(extractor: FakeExtractor, workers: int) -> None:
+    # Must run before `import server`: it sizes the extraction guard, scheduler and warm-up from the pool it builds
+    import extraction
+
+    class FakeExtractionPool(extraction.ExtractionPool):
+        def __init__(self, workers_: int = None, job=None):
+            super().__init__(workers_ or workers, job or extractor)
+
+    extraction.ExtractionPool = FakeExtractionPool
+
+def install_ytmusicapi() -> None:
+    # Lets the harness run where ytmusicapi isn't installed; the real client is replaced either way
+    if 'ytmusicapi' not in sys.modules:
+        try:
+            import ytmusicapi
+        except ImportError:
+            sys.modules['ytmusicapi'] = types.SimpleNamespace(YTMusic=FakeYTMusic)
+    import clients
+    clients.YTMusic = FakeYTMusic
@@ -0,0 +1,152 @@
+"""Offline load test for server.py.
+
+YTMusic is answered from hand-written fixtures (fixtures.json) and yt-dlp is replaced by a fake with configurable latency and
+failure rates, so no network is touched. Example:
+
+    python benchmark/run.py --concurrency 16 --requests 2000 --save-baseline main
+    python benchmark/run.py --concurrency 16 --requests 2000 --compare main
+"""
+import argparse, json, os, random, resource, sys, tempfile, threading, time
+from typing import Dict, List
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from fakes import FakeExtractor, FakeRedis, FakeYTMusic, LatencyModel, install_extractor, install_ytmusicapi
+
+BASELINES_DIR = os.path.join(BENCHMARK_DIR, 'baselines')
+ROUTE_WEIGHTS = {
+    'find_stream_list': 4,
+    'get_stream': 6,
+    'get_streams': 2,
+    'stream_playlist': 2,
+    'get_playlist_info': 1
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Offline load test for the flask server.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--distinct', type=int, default=50, help='distinct queries / playlists / video ids in the mix')
+    parser.add_argument('--ytmusic-latency-ms', type=float, default=150)
+    parser.add_argument('--extract-latency-ms', type=float, default=800)
+    parser.add_argument('--sigma', type=float, default=0.5, help='log-normal spread of upstream latencies')
+    parser.add_argument('--ytmusic-failure-rate', type=float, default=0.0)
+    parser.add_argument('--extract-failure-rate', type=float, default=0.01)
+    parser.add_argument('--playlist-size', type=int, default=150)
+    parser.add_argument('--extraction-workers', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--cache-backend', metavar='URL', help='CACHE_BACKEND for the server; "standin" starts a local fake redis')
+    parser.add_argument('--save-baseline', metavar='NAME')
+    parser.add_argument('--compare', metavar='NAME')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed relative regression against the baseline')
+    return parser.parse_args()
+
+def load_server(args):
+    os.environ['METADATA_DB'] = os.path.join(tempfile.mkdtemp(prefix='ytm-bench-'), 'metadata.db')
+    # Warm-up opens the YTMusic sessions with a HEAD to the real music.youtube.com
+    os.environ['WARMUP'] = '0'
+    if args.cache_backend == 'standin': os.environ['CACHE_BACKEND'] = FakeRedis().start().url
+    elif args.cache_backend: os.environ['CACHE_BACKEND'] = args.cache_backend
+    FakeYTMusic.latency = LatencyModel(args.ytmusic_latency_ms, args.sigma, args.ytmusic_failure_rate, args.seed)
+    FakeYTMusic.playlist_size = args.playlist_size
+    install_ytmusicapi()
+    install_extractor(FakeExtractor(LatencyModel(args.extract_latency_ms, args.sigma, args.extract_failure_rate, args.seed + 1)), args.extraction_workers)
+
+    import server
+    return server
+
+def build_workload(args) -> List[str]:
+    rng = random.Random(args.seed)
+    filters = ['songs', 'artists', 'albums']
+    routes = rng.choices(list(ROUTE_WEIGHTS), weights=list(ROUTE_WEIGHTS.values()), k=args.requests)
+    urls = []
+    for i, route in enumerate(routes):
+        key = rng.randrange(args.distinct)
+        if route == 'find_stream_list': urls.append(f'/find_stream_list/?query=query {key}&filter={filters[key % 3]}&user=u{i % 4}')
+        elif route == 'get_stream': urls.append(f'/get_stream/?video_id=bench{key:06d}&user=u{i % 4}')
+        elif route == 'get_streams':
+            ids = ','.join(f'bench{rng.randrange(args.distinct):06d}' for _ in range(5))
+            urls.append(f'/get_streams/?video_ids={ids}&stream=0')
+        elif route == 'stream_playlist': urls.append(f'/stream_playlist/?id=PLbench{key}&user=u{i % 4}')
+        else: urls.append(f'/get_playlist_info/?id=PLbench{key}')
+    return urls
+
+def percentile(values: List[float], q: float) -> float:
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def summarize(samples: List[tuple], elapsed: float) -> Dict:
+    def stats(rows):
+        latencies = [latency for _, latency, _ in rows]
+        return {
+            'requests': len(rows),
+            'errors': len([1 for _, _, status in rows if status >= 500]),
+            'rps': round(len(rows) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2)
+        }
+    routes = sorted({route for route, _, _ in samples})
+    return {
+        'overall': stats(samples),
+        'routes': {route: stats([s for s in samples if s[0] == route]) for route in routes},
+        'elapsed_s': round(elapsed, 2),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+def run_load(server, urls: List[str], concurrency: int) -> Dict:
+    samples, lock, position = [], threading.Lock(), iter(range(len(urls)))
+
+    def worker():
+        client = server.app.test_client()
+        while True:
+            with lock:
+                i = next(position, None)
+            if i is None: return
+            url = urls[i]
+            start = time.perf_counter()
+            response = client.get(url)
+            response.get_data()
+            latency = time.perf_counter() - start
+            with lock:
+                samples.append((url.split('/')[1], latency, response.status_code))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    return summarize(samples, time.perf_counter() - start)
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    regressions = []
+    for scope, current, base in [('overall', report['overall'], baseline['overall'])] + [
+        (route, report['routes'][route], baseline['routes'][route]) for route in report['routes'] if route in baseline['routes']
+    ]:
+        if current['rps'] < base['rps'] * (1 - tolerance): regressions.append(f"{scope}: rps {current['rps']} < baseline {base['rps']}")
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if current[key] > base[key] * (1 + tolerance): regressions.append(f"{scope}: {key} {current[key]} > baseline {base[key]}")
+    return regressions
+
+def main():
+    args = parse_args()
+    server = load_server(args)
+    report = run_load(server, build_workload(args), args.concurrency)
+    report['config'] = {k: v for k, v in vars(args).items() if k not in ('save_baseline', 'compare')}
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(os.path.join(BASELINES_DIR, f'{args.save_baseline}.json'), 'w') as f: json.dump(report, f, indent=2)
+    if args.compare:
+        with open(os.path.join(BASELINES_DIR, f'{args.compare}.json')) as f: baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for line in regressions: print(f'REGRESSION {line}', file=sys.stderr)
+        server.extraction_pool.shutdown()
+        sys.exit(1 if regressions else 0)
+    server.extraction_pool.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import asyncio, threading, time, re, unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+from backends import CacheBackend, pack, unpack
+
+# Backend writes leave the caller right away and are applied in order on one thread
+backend_writes = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cache-write')
+
+class TTLCache:
+    """Thread safe LRU cache where every entry carries its own expiry time.
+
+    With a `backend`, entries are written behind to it under `namespace` and local misses are filled from it,
+    so replicas sharing the backend reuse each other's work. Event loop code reads through `get_async`."""
+    def __init__(self, max_size: int = 1024, default_ttl: float = 300, backend: CacheBackend = None, namespace: str = ''):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.backend = backend
+        self.namespace = namespace
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.evictions = 0
+
+    def _get_local(self, key: str) -> Tuple[bool, Any]:
+        # (True, value) on a local hit; a miss is only counted here when there is no backend left to ask
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[0]
+            if self.backend is None: self.misses += 1
+        return False, None
+
+    def get(self, key: str) -> Optional[Any]:
+        found, value = self._get_local(key)
+        if found or self.backend is None: return value
+        return self._get_shared(key)
+
+    async def get_async(self, key: str) -> Optional[Any]:
+        # Same as get, but the backend round trip of a local miss runs on a worker thread instead of the event loop
+        found, value = self._get_local(key)
+        if found or self.backend is None: return value
+        return await asyncio.get_running_loop().run_in_executor(None, self._get_shared, key)
+
+    def _get_shared(self, key: str) -> Optional[Any]:
+        data = self.backend.get(f'{self.namespace}:{key}')
+        value, expires_at = unpack(data) if data else (None, 0)
+        with self._lock:
+            if value is None or expires_at <= time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.shared_hits += 1
+            self._store(key, value, expires_at)
+        return value
+
+    def _store(self, key: str, value: Any, expires_at: float) -> None:
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, key: str, value: Any, ttl: float = None) -> None:
+        if ttl is None: ttl = self.default_ttl
+        if ttl <= 0: return
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._store(key, value, expires_at)
+        if self.backend is not None: self._write_behind(self.backend.set, f'{self.namespace}:{key}', pack(value, expires_at), ttl)
+
+    def _write_behind(self, write, *args) -> None:
+        try:
+            backend_writes.submit(write, *args)
+        except RuntimeError:
+            # Interpreter shutting down; the entry just stays local
+            pass
+
+    def contains(self, key: str) -> bool:
+        # Lookup that leaves the hit/miss counters and lru order untouched
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[1] > time.time()
+
+    def expires_at(self, key: str) -> Optional[float]:
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[1] if entry else None
+
+    def pop(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if self.backend is not None: self._write_behind(self.backend.delete, f'{self.namespace}:{key}')
+        return entry[0] if entry else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class StreamCache(TTLCache):
+    """Caches resolved stream dicts by video_id until shortly before the googlevideo url expires."""
+    def __init__(self, max_size: int = 2048, safety_margin: float = 600, fallback_ttl: float = 1800, backend: CacheBackend = None):
+        super().__init__(max_size=max_size, default_ttl=fallback_ttl, backend=backend, namespace='stream')
+        self.safety_margin = safety_margin
+
+    @staticmethod
+    def get_url_expiry(url: str) -> Optional[float]:
+        # googlevideo urls carry the expiry either as a query param or as a /expire/<ts>/ path segment
+        parsed = urlparse(url)
+        expire = parse_qs(parsed.query).get('expire')
+        if expire: return float(expire[0])
+        match = re.search(r'/expire/(\d+)', parsed.path)
+        if match: return float(match.group(1))
+        return None
+
+    def put_stream(self, video_id: str, stream: Dict) -> None:
+        expires_at = StreamCache.get_url_expiry(stream.get('audio_url', ''))
+        if expires_at: ttl = expires_at - time.time() - self.safety_margin
+        else: ttl = self.default_ttl
+        self.put(video_id, stream, ttl)
+
+
+class SearchCache:
+    """Playlists found for a normalized query, with a ttl per filter tier and a short lived negative cache."""
+    TIER_TTLS = {
+        'albums': 7 * 24 * 3600,  # album track lists are effectively immutable
+        'artists': 6 * 3600,      # top songs drift slowly
+        'songs': 15 * 60          # radio lists should stay fresh
+    }
+
+    def __init__(self, max_size: int = 512, negative_ttl: float = 120, backend: CacheBackend = None):
+        self.tiers = {name: TTLCache(max_size, ttl, backend, f'search_{name}') for name, ttl in SearchCache.TIER_TTLS.items()}
+        self.negative = TTLCache(max_size, negative_ttl, backend, 'search_negative')
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        query = unicodedata.normalize('NFKC', query or '').casefold()
+        query = re.sub(r"[^\w\s]", ' ', query)
+        return ' '.join(query.split())
+
+    def get(self, filter: str, query: str) -> Tuple[bool, Any]:
+        key = SearchCache.normalize(query)
+        playlist = self.tiers[filter].get(key)
+        if playlist is not None: return True, playlist
+        if self.negative.get(f'{filter}:{key}') is not None: return True, None
+        return False, None
+
+    async def get_async(self, filter: str, query: str) -> Tuple[bool, Any]:
+        key = SearchCache.normalize(query)
+        playlist = await self.tiers[filter].get_async(key)
+        if playlist is not None: return True, playlist
+        if await self.negative.get_async(f'{filter}:{key}') is not None: return True, None
+        return False, None
+
+    def put(self, filter: str, query: str, playlist: Optional[list], ttl: float = None) -> None:
+        key = SearchCache.normalize(query)
+        if playlist: self.tiers[filter].put(key, playlist, ttl)
+        else: self.negative.put(f'{filter}:{key}', True)
+
+    def stats(self) -> Dict:
+        stats = {name: tier.stats() for name, tier in self.tiers.items()}
+        stats['negative'] = self.negative.stats()
+        return stats
@@ -0,0 +1,94 @@
+import os, queue, threading, time
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+from ytmusicapi import YTMusic
+
+class YTMusicPool:
+    """Process wide pool of YTMusic clients, each on its own keep-alive requests session."""
+    def __init__(self, size: int = None, max_uses: int = 1000, max_age: float = 1800):
+        self.size = size or int(os.environ.get('YTMUSIC_POOL_SIZE', 4))
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self.recycled = 0
+
+    def _create(self) -> dict:
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        return {'client': YTMusic(requests_session=session), 'session': session, 'uses': 0, 'created_at': time.time()}
+
+    def _checkout(self) -> dict:
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create: self._created += 1
+            if can_create:
+                try:
+                    return self._create()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            # Wait briefly for a client to come back, then re-check in case one was recycled
+            try:
+                return self._idle.get(timeout=0.25)
+            except queue.Empty:
+                continue
+
+    def _discard(self, entry: dict) -> None:
+        entry['session'].close()
+        with self._lock:
+            self._created -= 1
+            self.recycled += 1
+
+    @contextmanager
+    def client(self):
+        entry = self._checkout()
+        try:
+            yield entry['client']
+        except requests.RequestException:
+            # Broken connection or upstream reset; don't hand this session out again
+            self._discard(entry)
+            raise
+        except BaseException:
+            self._idle.put(entry)
+            raise
+        else:
+            entry['uses'] += 1
+            if entry['uses'] >= self.max_uses or time.time() - entry['created_at'] > self.max_age: self._discard(entry)
+            else: self._idle.put(entry)
+
+    def warm(self, url: str = 'https://music.youtube.com/') -> int:
+        # Open every session up front so the first requests skip client setup and the tls handshake
+        entries = []
+        while len(entries) < self.size:
+            with self._lock:
+                if self._created >= self.size: break
+                self._created += 1
+            try:
+                entry = self._create()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            try:
+                entry['session'].head(url, timeout=5)
+            except requests.RequestException:
+                pass
+            entries.append(entry)
+        for entry in entries: self._idle.put(entry)
+        return len(entries)
+
+    def call(self, method: str, *args, **kwargs):
+        with self.client() as ytmusic:
+            return getattr(ytmusic, method)(*args, **kwargs)
+
+    def stats(self) -> dict:
+        return {'size': self.size, 'open': self._created, 'idle': self._idle.qsize(), 'recycled': self.recycled}
@@ -0,0 +1,106 @@
+import multiprocessing, os, subprocess, threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+try:
+    import yt_dlp
+except ImportError:
+    yt_dlp = None
+
+YDL_OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+    'noplaylist': True,
+    'format': 'ba',
+    'extractor_args': {'youtube': {'player_client': ['ios']}}
+}
+CLI_COMMAND = ["yt-dlp", "--extractor-args", "youtube:player_client=ios", "--get-url", "--no-playlist", "--quiet", "-f", "ba", "-g"]
+
+# Workers come from a fork server (fresh interpreters where there is none), never from a fork of the server itself:
+# its renewal, warm-up, cache-write and io threads may hold locks at that moment and leave the child deadlocked
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+def importing_in_worker() -> bool:
+    # Forkserver and spawn children import the main module again before their first job; nothing may start threads then
+    return bool(getattr(multiprocessing.current_process(), '_inheriting', False))
+
+def _worker_context():
+    context = multiprocessing.get_context(START_METHOD)
+    # The fork server imports yt-dlp once, instead of the main module, so each worker forks from a warm interpreter
+    if START_METHOD == 'forkserver': context.set_forkserver_preload([__name__])
+    return context
+
+# One YoutubeDL per worker process, so extractors and player/nsig caches stay warm between jobs
+_ydl = None
+
+def _init_worker():
+    global _ydl
+    _ydl = yt_dlp.YoutubeDL(YDL_OPTIONS)
+
+def _extract(video_id: str) -> Optional[str]:
+    info = _ydl.extract_info(f'https://www.youtube.com/watch?v={video_id}', download=False)
+    if info.get('url'): return info['url']
+    formats = info.get('requested_formats') or []
+    return formats[0].get('url') if formats else None
+
+def _extract_cli(video_id: str) -> Optional[str]:
+    result = subprocess.run(CLI_COMMAND + [video_id], capture_output=True, text=True)
+    if result.returncode != 0: raise RuntimeError(result.stderr.strip())
+    return result.stdout.strip() or None
+
+
+class ExtractionPool:
+    """Long lived yt-dlp workers taking video_id jobs; falls back to the yt-dlp cli when the module is missing."""
+    def __init__(self, workers: int = None, job: Callable[[str], Optional[str]] = None):
+        self.workers = workers or int(os.environ.get('EXTRACTION_WORKERS', 0)) or os.cpu_count() or 1
+        # A custom job (e.g. the benchmark's fake yt-dlp) always runs on threads
+        self.job = job
+        self.in_process = yt_dlp is not None and job is None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.in_process: self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_worker_context(), initializer=_init_worker)
+                else: self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='yt-dlp')
+            return self._executor
+
+    def _reset(self, executor) -> None:
+        with self._lock:
+            if self._executor is executor: self._executor = None
+        executor.shutdown(wait=False)
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, video_id: str) -> Future:
+        executor = self._get_executor()
+        job = self.job or (_extract if self.in_process else _extract_cli)
+        try:
+            future = executor.submit(job, video_id)
+        except BrokenProcessPool:
+            # A worker died (oom, segfault); start a fresh pool and retry once
+            self._reset(executor)
+            future = self._get_executor().submit(job, video_id)
+        with self._lock:
+            self._pending += 1
+        future.add_done_callback(self._done)
+        return future
+
+    def warm(self, video_id: str, timeout: float = 60) -> int:
+        # One canary job per worker, so every process has its extractor and player script loaded
+        futures = [self.submit(video_id) for _ in range(self.workers)]
+        return len([url for url in (future.result(timeout=timeout) for future in futures) if url])
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor: executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,192 @@
+import re, socket, threading, time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable
+import requests
+
+# Errors that say the upstream itself is struggling; anything else (an unavailable or region locked video,
+# a response that failed to parse) is about the one item asked for and says nothing about upstream health
+TRANSIENT_ERRORS = (TimeoutError, socket.timeout, ConnectionError, requests.Timeout, requests.ConnectionError)
+TRANSIENT_STATUS = re.compile(r'HTTP(?: Error)? (429|5\d\d)\b')
+TRANSIENT_MESSAGE = re.compile(r'timed out|connection (?:reset|refused|aborted)|remote end closed|name resolution', re.IGNORECASE)
+
+def is_upstream_failure(error: BaseException) -> bool:
+    if isinstance(error, TRANSIENT_ERRORS): return True
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is not None: return status == 429 or status >= 500
+    # yt-dlp and ytmusicapi report http and socket errors inside the message of their own exception types
+    message = str(error)
+    return bool(TRANSIENT_STATUS.search(message) or TRANSIENT_MESSAGE.search(message))
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+
+class Overloaded(UpstreamUnavailable):
+    """Raised when a call waited too long, or found the queue full, under the current concurrency limit."""
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit: grows by one per window of fast successes, shrinks by `backoff` on errors or slow calls."""
+    def __init__(self, initial: int, min_limit: int = 1, max_limit: int = 64, target_latency: float = 2.0, backoff: float = 0.75):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self._decreased_at = 0.0
+
+    @property
+    def capacity(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    def on_complete(self, latency: float, failed: bool) -> None:
+        if failed or latency > self.target_latency:
+            # Calls started in the same window all see the same congestion; only back off once for them
+            now = time.monotonic()
+            if now - self._decreased_at < self.target_latency: return
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            self._decreased_at = now
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; after `reset_timeout` a single probe decides whether to close."""
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == 'closed': return True
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout: self.state = 'half_open'
+        if self.state == 'half_open' and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def release(self) -> None:
+        # The half-open probe ended without an outcome (cancelled, or expired before it ran); the next call probes instead
+        if self.state == 'half_open': self._probing = False
+
+    def record(self, failed: bool) -> None:
+        if not failed:
+            self.state, self.failures, self._probing = 'closed', 0, False
+            return
+        self.failures += 1
+        if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.threshold):
+            self.state, self.opened_at, self._probing = 'open', time.monotonic(), False
+            self.trips += 1
+
+
+class UpstreamGuard:
+    """Admits calls to one upstream through an AdaptiveLimiter and a CircuitBreaker; calls over the limit wait in a bounded fifo.
+
+    Only errors `classify` blames on the upstream count against it; other errors count as successful calls."""
+    def __init__(self, name: str, limiter: AdaptiveLimiter, breaker: CircuitBreaker = None, max_wait: float = 4.0, max_queue: int = 64,
+                 classify: Callable[[BaseException], bool] = is_upstream_failure):
+        self.name = name
+        self.limiter = limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.classify = classify
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.rejected = 0
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._probe = None
+
+    def submit(self, start: Callable[[], Future]) -> Future:
+        # `start` is only called once a slot is free; the returned future mirrors the one it gives back
+        future = Future()
+        error, run = None, False
+        with self._lock:
+            if not self.breaker.allow(): error = UpstreamUnavailable(f'{self.name} is unavailable, circuit open')
+            else:
+                # The breaker admits one probe while half open; remember which call it is in case it never runs
+                if self.breaker.state == 'half_open': self._probe = future
+                if self.in_flight < self.limiter.capacity: self.in_flight, run = self.in_flight + 1, True
+                elif len(self._queue) >= self.max_queue: error = Overloaded(f'{self.name} is overloaded, queue full')
+                else: self._queue.append((start, future, time.monotonic()))
+            if error:
+                self.rejected += 1
+                self._release_probe(future)
+        if error: future.set_exception(error)
+        elif run: self._run(start, future)
+        return future
+
+    def _release_probe(self, future: Future) -> None:
+        # Called with the lock held for a call that ended without reaching the upstream
+        if self._probe is future:
+            self._probe = None
+            self.breaker.release()
+
+    def _run(self, start: Callable[[], Future], future: Future) -> None:
+        if future.cancelled():
+            self._finish(future, None, failed=False)
+            return
+        started = time.monotonic()
+        try:
+            inner = start()
+        except Exception as e:
+            self._finish(future, started, failed=self.classify(e))
+            if future.set_running_or_notify_cancel(): future.set_exception(e)
+            return
+        # Cancelling the caller's future (e.g. an abandoned prefetch) cancels the upstream call too
+        future.add_done_callback(lambda f: f.cancelled() and inner.cancel())
+        inner.add_done_callback(lambda inner: self._on_done(future, inner, started))
+
+    def _on_done(self, future: Future, inner: Future, started: float) -> None:
+        if inner.cancelled():
+            self._finish(future, None, failed=False)
+            future.cancel()
+            return
+        error = inner.exception()
+        self._finish(future, started, failed=error is not None and self.classify(error))
+        if not future.set_running_or_notify_cancel(): return
+        if error: future.set_exception(error)
+        else: future.set_result(inner.result())
+
+    def _finish(self, future: Future, started: float, failed: bool) -> None:
+        ready, expired = [], []
+        with self._lock:
+            self.in_flight -= 1
+            # Calls that never reached the upstream say nothing about its health
+            if started is not None:
+                if self._probe is future: self._probe = None
+                self.limiter.on_complete(time.monotonic() - started, failed)
+                self.breaker.record(failed)
+            else: self._release_probe(future)
+            now = time.monotonic()
+            while self._queue and self.in_flight < self.limiter.capacity:
+                start, queued, enqueued_at = self._queue.popleft()
+                if queued.cancelled():
+                    self._release_probe(queued)
+                    continue
+                if now - enqueued_at > self.max_wait:
+                    self._release_probe(queued)
+                    expired.append(queued)
+                    continue
+                self.in_flight += 1
+                ready.append((start, queued))
+            self.rejected += len(expired)
+        for queued in expired:
+            if queued.set_running_or_notify_cancel(): queued.set_exception(Overloaded(f'{self.name} is overloaded, waited over {self.max_wait}s'))
+        for start, queued in ready:
+            self._run(start, queued)
+
+    def stats(self) -> dict:
+        return {
+            'limit': round(self.limiter.limit, 2),
+            'in_flight': self.in_flight,
+            'queued': len(self._queue),
+            'rejected': self.rejected,
+            'circuit': self.breaker.state,
+            'trips': self.breaker.trips
+        }
@@ -0,0 +1,119 @@
+import threading, time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple, extra: Dict = None) -> str:
+    pairs = list(zip(labelnames, values)) + list((extra or {}).items())
+    if not pairs: return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+class Counter:
+    """Either incremented directly or read at scrape time from a callback returning {labels: value}."""
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), callback: Callable[[], Dict[Tuple, float]] = None):
+        self.name, self.help, self.labelnames, self.callback = name, help, labelnames, callback
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        if self.callback: values.update(self.callback())
+        for labels, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), callback: Callable[[], Dict[Tuple, float]] = None):
+        self.name, self.help, self.labelnames, self.callback = name, help, labelnames, callback
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        with self._lock:
+            values = dict(self._values)
+        if self.callback: values.update(self.callback())
+        for labels, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help, labelnames, tuple(sorted(buckets))
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *labels, value: float) -> None:
+        with self._lock:
+            series = self._values.setdefault(labels, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((labels, list(counts), total, count) for labels, (counts, total, count) in self._values.items())
+        for labels, counts, total, count in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, {"le": bound})} {bucket_count}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, {"le": "+Inf"})} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+
+registry = Registry()
+request_latency = registry.register(Histogram('ytm_request_duration_seconds', 'Request latency by route.', ('route', 'status')))
+stage_latency = registry.register(Histogram('ytm_stage_duration_seconds', 'Latency of each upstream stage.', ('stage',)))
+upstream_errors = registry.register(Counter('ytm_upstream_errors_total', 'Upstream calls that raised, by stage.', ('stage',)))
+in_flight = registry.register(Gauge('ytm_requests_in_flight', 'Requests currently being handled, by route.', ('route',)))
+
+def observe_stage(stage: str, seconds: float, failed: bool = False) -> None:
+    stage_latency.observe(stage, value=seconds)
+    if failed: upstream_errors.inc(stage)
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        observe_stage(name, time.perf_counter() - start, failed)
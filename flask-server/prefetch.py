@@ -0,0 +1,69 @@
+import os, threading
+from concurrent.futures import Future
+from typing import Callable, List
+from caching import StreamCache
+
+class PrefetchJob:
+    def __init__(self, user: str, video_ids: List[str]):
+        self.user = user
+        self.queue = list(video_ids)
+        self.futures = {}
+        self.cancelled = False
+        self.resolved = 0
+
+
+class Prefetcher:
+    """Resolves the upcoming tracks of a freshly returned playlist into the stream cache, one job per user."""
+    def __init__(self, submit: Callable[[str, str], Future], cache: StreamCache, depth: int = None, concurrency: int = None):
+        self.submit = submit
+        self.cache = cache
+        self.depth = depth if depth is not None else int(os.environ.get('PREFETCH_DEPTH', 5))
+        self.concurrency = concurrency or int(os.environ.get('PREFETCH_CONCURRENCY', 2))
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.scheduled = 0
+        self.cancelled = 0
+
+    def schedule(self, user: str, video_ids: List[str]) -> None:
+        video_ids = [i for i in video_ids[:self.depth] if i]
+        job = PrefetchJob(user, video_ids)
+        with self._lock:
+            previous = self._jobs.get(user)
+            self._jobs[user] = job
+        if previous: self.cancel(previous)
+        if video_ids: self._pump(job)
+
+    def cancel(self, job: PrefetchJob) -> None:
+        with self._lock:
+            job.cancelled = True
+            job.queue.clear()
+            futures = list(job.futures.values())
+            if self._jobs.get(job.user) is job: del self._jobs[job.user]
+        for future in futures:
+            if future.cancel(): self.cancelled += 1
+
+    def _pump(self, job: PrefetchJob) -> None:
+        # Keep at most `concurrency` extractions in flight per job, submitted in play order
+        to_submit = []
+        with self._lock:
+            while not job.cancelled and job.queue and len(job.futures) + len(to_submit) < self.concurrency:
+                video_id = job.queue.pop(0)
+                if video_id in job.futures or self.cache.contains(video_id): continue
+                to_submit.append(video_id)
+        for video_id in to_submit:
+            future = self.submit(video_id, job.user)
+            with self._lock:
+                job.futures[video_id] = future
+                self.scheduled += 1
+            future.add_done_callback(lambda f, video_id=video_id: self._on_done(job, video_id, f))
+
+    def _on_done(self, job: PrefetchJob, video_id: str, future: Future) -> None:
+        with self._lock:
+            job.futures.pop(video_id, None)
+            finished = not job.cancelled and not job.queue and not job.futures
+            if finished and self._jobs.get(job.user) is job: del self._jobs[job.user]
+        if not future.cancelled() and future.exception() is None and future.result(): job.resolved += 1
+        if not job.cancelled: self._pump(job)
+
+    def stats(self) -> dict:
+        return {'depth': self.depth, 'concurrency': self.concurrency, 'active_jobs': len(self._jobs), 'scheduled': self.scheduled, 'cancelled': self.cancelled}
@@ -0,0 +1,220 @@
+import os, re, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+import requests
+from flask import Response
+
+CHUNK_SIZE = 10 * 1024 * 1024
+EXTENSIONS = {'audio/mp4': 'm4a', 'audio/webm': 'webm'}
+MIMETYPES = {extension: mimetype for mimetype, extension in EXTENSIONS.items()}
+VIDEO_ID = re.compile(r'[\w-]{11}', re.ASCII)
+
+def is_video_id(video_id: str) -> bool:
+    # video ids become file names, so anything else never reaches the disk (or an extraction)
+    return bool(video_id and VIDEO_ID.fullmatch(video_id))
+
+class CachedAudio:
+    def __init__(self, path: str, size: int, mimetype: str):
+        self.path = path
+        self.size = size
+        self.mimetype = mimetype
+
+
+class AudioCache:
+    """Completed audio files on disk, bounded in total bytes and evicted least recently used first."""
+    def __init__(self, directory: str = None, max_bytes: int = None):
+        self.directory = directory or os.environ.get('AUDIO_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audio_cache')
+        self.max_bytes = max_bytes or int(os.environ.get('AUDIO_CACHE_MAX_MB', 2048)) * 1024 * 1024
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        files = []
+        for name in os.listdir(self.directory):
+            video_id, _, extension = name.rpartition('.')
+            if extension not in MIMETYPES or not is_video_id(video_id): continue
+            path = os.path.join(self.directory, name)
+            stat = os.stat(path)
+            files.append((stat.st_atime, video_id, CachedAudio(path, stat.st_size, MIMETYPES[extension])))
+        for _, video_id, entry in sorted(files, key=lambda f: f[0]):
+            self._entries[video_id] = entry
+            self.total_bytes += entry.size
+
+    def lookup(self, video_id: str) -> Optional[CachedAudio]:
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is None or not os.path.exists(entry.path):
+                if entry is not None: self._forget(video_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(video_id)
+            self.hits += 1
+        return entry
+
+    def _forget(self, video_id: str) -> None:
+        entry = self._entries.pop(video_id, None)
+        if entry: self.total_bytes -= entry.size
+
+    def partial_path(self, video_id: str) -> str:
+        if not is_video_id(video_id): raise ValueError(f'Invalid video id "{video_id}"')
+        return os.path.join(self.directory, f'{video_id}.part')
+
+    def commit(self, video_id: str, partial_path: str, mimetype: str) -> None:
+        if not is_video_id(video_id): raise ValueError(f'Invalid video id "{video_id}"')
+        path = os.path.join(self.directory, f"{video_id}.{EXTENSIONS.get(mimetype, 'm4a')}")
+        os.replace(partial_path, path)
+        with self._lock:
+            self._forget(video_id)
+            entry = self._entries[video_id] = CachedAudio(path, os.path.getsize(path), mimetype)
+            self.total_bytes += entry.size
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.size
+                try:
+                    os.remove(evicted.path)
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        return {'files': len(self._entries), 'bytes': self.total_bytes, 'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+class WriteThrough:
+    """Body of a proxied read that starts at byte 0, copied into the partial file as the client reads it.
+
+    Once the response closes, whatever the client didn't read (a short range, a hang up) is fetched in the background."""
+    def __init__(self, relay: 'AudioRelay', video_id: str, url: str, upstream: requests.Response):
+        self.relay = relay
+        self.video_id = video_id
+        self.url = url
+        self.upstream = upstream
+        self.total = AudioRelay.get_total_size(upstream)
+        self.offset = 0
+        self.file = open(relay.cache.partial_path(video_id), 'wb')
+
+    def __iter__(self):
+        for chunk in self.upstream.iter_content(64 * 1024):
+            self.file.write(chunk)
+            self.offset += len(chunk)
+            yield chunk
+
+    def close(self) -> None:
+        if self.file.closed: return
+        self.upstream.close()
+        self.file.close()
+        self.relay.resume(self.video_id, self.url, self.offset, self.total)
+
+
+class AudioRelay:
+    """Proxies ranged reads of upstream audio while writing the whole file through to the AudioCache.
+
+    A cache miss read from the first byte is teed into the cache file, so each track is downloaded once."""
+    def __init__(self, cache: AudioCache, workers: int = 2):
+        self.cache = cache
+        self.session = requests.Session()
+        self._downloads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='audio-fill')
+        self._filling = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_mimetype(url: str) -> str:
+        mime = parse_qs(urlparse(url).query).get('mime')
+        return mime[0].split(';')[0] if mime else 'audio/mp4'
+
+    @staticmethod
+    def get_range_start(upstream: requests.Response) -> Optional[int]:
+        if upstream.status_code == 200: return 0
+        match = re.match(r'bytes (\d+)-', upstream.headers.get('Content-Range', ''))
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def get_total_size(upstream: requests.Response) -> Optional[int]:
+        match = re.search(r'/(\d+)$', upstream.headers.get('Content-Range', ''))
+        if match: return int(match.group(1))
+        if upstream.status_code == 200 and 'Content-Length' in upstream.headers: return int(upstream.headers['Content-Length'])
+        return None
+
+    def _claim(self, video_id: str) -> bool:
+        # At most one download per video_id writes its partial file
+        if not is_video_id(video_id): return False
+        with self._lock:
+            if video_id in self._filling: return False
+            self._filling.add(video_id)
+        return True
+
+    def fill(self, video_id: str, url: str) -> None:
+        if self._claim(video_id): self._downloads.submit(self._download, video_id, url)
+
+    def resume(self, video_id: str, url: str, offset: int, total: int = None) -> None:
+        # Takes over a claimed partial file holding the first `offset` bytes
+        self._downloads.submit(self._download, video_id, url, offset, total)
+
+    def _download(self, video_id: str, url: str, offset: int = 0, total: int = None) -> None:
+        # googlevideo throttles long unranged reads, so fetch in fixed size ranges
+        partial_path = self.cache.partial_path(video_id)
+        try:
+            with open(partial_path, 'ab' if offset else 'wb') as f:
+                while total is None or offset < total:
+                    start = offset
+                    headers = {'Range': f'bytes={offset}-{offset + CHUNK_SIZE - 1}'}
+                    with self.session.get(url, headers=headers, stream=True, timeout=30) as upstream:
+                        if upstream.status_code == 416 and total is None and offset:
+                            # Asked just past the end of a file whose size was never sent
+                            total = offset
+                            break
+                        upstream.raise_for_status()
+                        size = AudioRelay.get_total_size(upstream)
+                        if size is not None: total = size
+                        if upstream.status_code == 200 and offset:
+                            # Range ignored, the whole file is coming: start the partial file over
+                            f.truncate(0)
+                            offset = start = 0
+                        for chunk in upstream.iter_content(256 * 1024):
+                            f.write(chunk)
+                            offset += len(chunk)
+                    if upstream.status_code == 200:
+                        # A whole body read to its end is the file, even without a Content-Length
+                        if total is None: total = offset
+                        break
+                    if total is None and offset and offset - start < CHUNK_SIZE:
+                        # No total in the Content-Range (bytes a-b/*): a short or empty range is the end of the file
+                        total = offset
+                    elif offset == start: raise IOError(f'upstream returned no data at byte {offset}')
+            if offset != total: raise IOError(f'downloaded {offset} of {total} bytes')
+            self.cache.commit(video_id, partial_path, AudioRelay.get_mimetype(url))
+        except Exception as e:
+            print("Error: ", e)
+            if os.path.exists(partial_path): os.remove(partial_path)
+        finally:
+            with self._lock:
+                self._filling.discard(video_id)
+
+    def proxy(self, url: str, range_header: str = None, video_id: str = None) -> Response:
+        # With a video_id the file is cached too: written through when the read starts at byte 0, else filled alongside
+        upstream = self.session.get(url, headers={'Range': range_header} if range_header else {}, stream=True, timeout=30)
+        headers = {name: upstream.headers[name] for name in ('Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges') if name in upstream.headers}
+        body = None
+        if video_id and upstream.ok:
+            if AudioRelay.get_range_start(upstream) != 0: self.fill(video_id, url)
+            elif self._claim(video_id):
+                try:
+                    body = WriteThrough(self, video_id, url, upstream)
+                except Exception as e:
+                    print("Error: ", e)
+                    with self._lock:
+                        self._filling.discard(video_id)
+        if body is None:
+            body = upstream.iter_content(64 * 1024)
+        response = Response(body, status=upstream.status_code, headers=headers)
+        response.call_on_close(upstream.close)
+        return response
+
+    def stats(self) -> dict:
+        return {'filling': len(self._filling), **self.cache.stats()}
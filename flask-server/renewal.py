@@ -0,0 +1,111 @@
+import math, os, threading, time
+from concurrent.futures import Future
+from typing import Callable, Dict
+from caching import StreamCache
+
+# How strongly a video_id is expected to be played again, by how it was handed out
+WEIGHT_PLAYING = 3
+WEIGHT_BATCH = 2
+WEIGHT_QUEUED = 1
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1: return False
+        self.tokens -= 1
+        return True
+
+
+class RenewalScheduler:
+    """Re-resolves recently issued stream urls shortly before their cache entry expires, most likely plays first."""
+    def __init__(self, cache: StreamCache, refresh: Callable[[str], Future], lead_time: float = 900, half_life: float = 3600,
+                 rate: float = None, burst: int = 5, interval: float = 30, max_tracked: int = 2000):
+        self.cache = cache
+        self.refresh = refresh
+        self.lead_time = lead_time
+        self.half_life = half_life
+        self.budget = TokenBucket(rate or float(os.environ.get('RENEWALS_PER_SECOND', 0.5)), burst)
+        self.interval = interval
+        self.max_tracked = max_tracked
+        self._tracked: Dict[str, tuple] = {}
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.renewed = 0
+        self.failed = 0
+
+    def track(self, video_id: str, weight: float = WEIGHT_PLAYING) -> None:
+        if not video_id: return
+        with self._lock:
+            previous_weight = self._tracked.get(video_id, (0, 0))[0]
+            self._tracked[video_id] = (max(weight, previous_weight), time.time())
+            if len(self._tracked) > self.max_tracked:
+                for stale in sorted(self._tracked, key=self._score)[:len(self._tracked) - self.max_tracked]:
+                    del self._tracked[stale]
+
+    def _score(self, video_id: str) -> float:
+        weight, issued_at = self._tracked[video_id]
+        return weight * math.exp(-(time.time() - issued_at) * math.log(2) / self.half_life)
+
+    def due(self) -> list:
+        # Tracked ids whose cached url is about to lapse, ordered by likelihood of being played. Ids with no live entry are
+        # left alone: their extraction failed, was cancelled or is still running, and a play resolves them on demand anyway
+        now = time.time()
+        with self._lock:
+            for video_id in [v for v in self._tracked if self._score(v) < 0.05]: del self._tracked[video_id]
+            in_flight = list(self._in_flight.items())
+            candidates = [v for v in self._tracked if v not in self._in_flight]
+            scores = {v: self._score(v) for v in candidates}
+        # A refresh still waiting for a background slot once its url lapsed is moot: drop it and let a play resolve the id
+        for video_id, future in in_flight:
+            if (self.cache.expires_at(video_id) or 0) <= now: future.cancel()
+        due = [v for v in candidates if now < (self.cache.expires_at(v) or 0) < now + self.lead_time]
+        return sorted(due, key=lambda v: scores[v], reverse=True)
+
+    def run_once(self) -> int:
+        started = 0
+        for video_id in self.due():
+            if not self.budget.take(): break
+            future = self.refresh(video_id)
+            with self._lock:
+                self._in_flight[video_id] = future
+            future.add_done_callback(lambda f, video_id=video_id: self._on_done(video_id, f))
+            started += 1
+        return started
+
+    def _on_done(self, video_id: str, future: Future) -> None:
+        renewed = not future.cancelled() and future.exception() is None and bool(future.result())
+        with self._lock:
+            self._in_flight.pop(video_id, None)
+            # Unavailable or region locked videos fail the same way every time; stop retrying until they are handed out again
+            if not renewed: self._tracked.pop(video_id, None)
+        if renewed: self.renewed += 1
+        else: self.failed += 1
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print("Error: ", e)
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive(): return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='stream-renewal', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {'tracked': len(self._tracked), 'in_flight': len(self._in_flight), 'renewed': self.renewed, 'failed': self.failed}
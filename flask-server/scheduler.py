@@ -0,0 +1,131 @@
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Callable, Dict
+
+INTERACTIVE = 0
+ENQUEUE = 1
+BACKGROUND = 2
+PRIORITIES = {'interactive': INTERACTIVE, 'enqueue': ENQUEUE, 'background': BACKGROUND}
+
+class ScheduledJob:
+    def __init__(self, key: str, start: Callable[[], Future], user: str, priority: int):
+        self.key = key
+        self.start = start
+        self.user = user
+        self.priority = priority
+        self.future = Future()
+
+
+class FairScheduler:
+    """Starts jobs by priority class, round robin between users within a class, never exceeding `capacity()` running.
+
+    `reserved` slots are kept free of background work so an interactive job never waits behind a prefetch."""
+    def __init__(self, capacity: Callable[[], int], reserved: int = 1):
+        self.capacity = capacity
+        self.reserved = reserved
+        self.running = 0
+        self._classes = [OrderedDict() for _ in PRIORITIES]
+        self._queued: Dict[str, ScheduledJob] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.started = [0] * len(PRIORITIES)
+        self.promoted = 0
+
+    def submit(self, key: str, start: Callable[[], Future], user: str = None, priority: int = INTERACTIVE) -> Future:
+        job = ScheduledJob(key, start, user or '', priority)
+        with self._lock:
+            self._classes[priority].setdefault(job.user, deque()).append(job)
+            self._queued[key] = job
+        job.future.add_done_callback(lambda f: f.cancelled() and self._discard(job))
+        self._dispatch()
+        return job.future
+
+    def promote(self, key: str, priority: int, user: str = None) -> None:
+        # A more urgent caller joined a queued job (through single_flight); move it up to that caller's class and queue
+        with self._lock:
+            job = self._queued.get(key)
+            if job is None or job.priority <= priority: return
+            self._remove(job)
+            job.priority, job.user = priority, user or job.user
+            self._classes[priority].setdefault(job.user, deque()).append(job)
+            self.promoted += 1
+        self._dispatch()
+
+    def _remove(self, job: ScheduledJob) -> None:
+        users = self._classes[job.priority]
+        users[job.user].remove(job)
+        if not users[job.user]: del users[job.user]
+
+    def _discard(self, job: ScheduledJob) -> None:
+        # A cancelled job leaves its queue right away; with no background slot nothing would ever pop it otherwise
+        with self._lock:
+            if job in self._classes[job.priority].get(job.user, ()): self._remove(job)
+            if self._queued.get(job.key) is job: del self._queued[job.key]
+
+    def _next(self):
+        capacity = self.capacity()
+        for priority, users in enumerate(self._classes):
+            # Background work may end up with no slot at all (capacity 1): it waits until the limit grows again
+            limit = capacity if priority != BACKGROUND else max(0, capacity - self.reserved)
+            if self.running >= limit: continue
+            while users:
+                user, jobs = users.popitem(last=False)
+                job = jobs.popleft()
+                # Back of the line for this user's next job, behind everyone else waiting in the class
+                if jobs: users[user] = jobs
+                if self._queued.get(job.key) is job: del self._queued[job.key]
+                if job.future.cancelled(): continue
+                self.running += 1
+                self.started[priority] += 1
+                return job
+        return None
+
+    def _dispatch(self) -> None:
+        # Jobs that fail or finish synchronously land back here; let the outer loop carry on instead of recursing
+        if getattr(self._local, 'dispatching', False): return
+        self._local.dispatching = True
+        try:
+            while True:
+                with self._lock:
+                    job = self._next()
+                if job is None: return
+                self._run(job)
+        finally:
+            self._local.dispatching = False
+
+    def _run(self, job: ScheduledJob) -> None:
+        try:
+            inner = job.start()
+        except Exception as e:
+            self._finish()
+            if job.future.set_running_or_notify_cancel(): job.future.set_exception(e)
+            return
+        job.future.add_done_callback(lambda f: f.cancelled() and inner.cancel())
+        inner.add_done_callback(lambda inner: self._on_done(job.future, inner))
+
+    def _on_done(self, future: Future, inner: Future) -> None:
+        self._finish()
+        if inner.cancelled():
+            future.cancel()
+            return
+        if not future.set_running_or_notify_cancel(): return
+        if inner.exception(): future.set_exception(inner.exception())
+        else: future.set_result(inner.result())
+
+    def _finish(self) -> None:
+        with self._lock:
+            self.running -= 1
+        self._dispatch()
+
+    def stats(self) -> dict:
+        with self._lock:
+            queued = {name: sum(len(jobs) for jobs in self._classes[priority].values()) for name, priority in PRIORITIES.items()}
+            users = len({user for users in self._classes for user in users})
+        return {
+            'running': self.running,
+            'queued': queued,
+            'waiting_users': users,
+            'started': {name: self.started[priority] for name, priority in PRIORITIES.items()},
+            'promoted': self.promoted
+        }
@@ -1,14 +1,68 @@
-import asyncio, time, re, subprocess
-# import yt_dlp
-from ytmusicapi import YTMusic
-from flask import Flask, request, render_template, jsonify
+import asyncio, time, re, json, os
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from flask import Flask, Response, g, request, render_template, jsonify, send_file
+from caching import TTLCache, StreamCache, SearchCache
+from extraction import ExtractionPool, importing_in_worker
+from clients import YTMusicPool
+from prefetch import Prefetcher
+from singleflight import SingleFlight
+from store import MetadataStore
+from sync import compute_delta, keys_digest, track_keys
+from relay import AudioCache, AudioRelay, is_video_id
+from warmup import Warmup
+from limiter import AdaptiveLimiter, UpstreamGuard, UpstreamUnavailable
+from scheduler import FairScheduler, PRIORITIES, INTERACTIVE, ENQUEUE, BACKGROUND
+from renewal import RenewalScheduler, WEIGHT_PLAYING, WEIGHT_BATCH, WEIGHT_QUEUED
+import backends, wire, metrics
 
 app = Flask(__name__)
+warmup = Warmup()
+# Set CACHE_BACKEND (sqlite:///path or redis://host:port) so replicas share resolved streams, searches and playlists
+cache_backend = backends.from_url()
+stream_cache = StreamCache(backend=cache_backend)
+search_cache = SearchCache(backend=cache_backend)
+PLAYLIST_TTL = 600
+playlist_cache = TTLCache(max_size=64, default_ttl=PLAYLIST_TTL, backend=cache_backend, namespace='playlist')
+# Latest (playlist, key digest, version) per playlist, so window requests on an unchanged playlist neither re-hash nor re-insert it
+playlist_versions = TTLCache(max_size=64, default_ttl=PLAYLIST_TTL)
+metadata_store = MetadataStore()
+extraction_pool = ExtractionPool()
+ytmusic_pool = YTMusicPool()
+single_flight = SingleFlight()
+background = ThreadPoolExecutor(max_workers=2, thread_name_prefix='background')
+ytmusic_calls = ThreadPoolExecutor(max_workers=32, thread_name_prefix='ytmusic')
+# Disk and cache backend i/o made from async views; under asgi.py the event loop serves every in-flight request
+io_calls = ThreadPoolExecutor(max_workers=8, thread_name_prefix='io')
+# Search and browse endpoints are throttled separately by YouTube, so each gets its own limit and circuit.
+# Neither may exceed the client pool, or the latency it sees would be the wait for a free client, not YouTube's.
+upstream_guards = {
+    'search': UpstreamGuard('search', AdaptiveLimiter(initial=min(4, ytmusic_pool.size), max_limit=ytmusic_pool.size, target_latency=1.5)),
+    'browse': UpstreamGuard('browse', AdaptiveLimiter(initial=min(4, ytmusic_pool.size), max_limit=ytmusic_pool.size, target_latency=2.0)),
+    'extraction': UpstreamGuard('extraction', AdaptiveLimiter(initial=extraction_pool.workers, max_limit=extraction_pool.workers * 2, target_latency=5.0))
+}
+# Orders extractions ahead of the guard: interactive before enqueue before prefetch/renewal, round robin per user
+extraction_scheduler = FairScheduler(lambda: upstream_guards['extraction'].limiter.capacity)
+audio_relay = AudioRelay(AudioCache())
+MAX_BATCH_SIZE = 50
+MAX_WINDOW_SIZE = 500
+AUDIO_RELAY = os.environ.get('AUDIO_RELAY') == '1'
+# The https url Alexa reaches this server on; behind ngrok or a load balancer request.host_url is the internal http one
+PUBLIC_URL = os.environ.get('PUBLIC_URL')
+if AUDIO_RELAY and not PUBLIC_URL: raise RuntimeError('AUDIO_RELAY=1 needs PUBLIC_URL, the https url Alexa reaches this server on')
+PIPELINE_FIRST_STREAM = os.environ.get('PIPELINE_FIRST_STREAM', '1') == '1'
+WARMUP_CANARY = os.environ.get('WARMUP_CANARY', 'jNQXAC9IVRw')
 
 class Supporting:
-    async def get_radiolist(song_name: str):
-        ytmusic = YTMusic()
-        search_results = await asyncio.to_thread(ytmusic.search, query=song_name, filter='songs', ignore_spelling=True)
+    def blocking(function, *args, **kwargs):
+        return asyncio.wrap_future(io_calls.submit(function, *args, **kwargs))
+
+    async def upstream(method: str, *args, **kwargs):
+        guard = upstream_guards['search' if method == 'search' else 'browse']
+        with metrics.stage(method):
+            return await asyncio.wrap_future(guard.submit(lambda: ytmusic_calls.submit(ytmusic_pool.call, method, *args, **kwargs)))
+
+    async def get_radiolist(song_name: str, user: str = None):
+        search_results = await Supporting.upstream('search', query=song_name, filter='songs', ignore_spelling=True)
         if not search_results:
             return None
 
@@ -16,7 +70,9 @@ class Supporting:
         if not video_id:
             return None
 
-        radio_results = await asyncio.to_thread(ytmusic.get_watch_playlist, videoId=video_id, radio=True)
+        # The radio always opens with the seed track, so its stream can resolve while the radio is fetched
+        Supporting.start_stream(video_id, user)
+        radio_results = await Supporting.upstream('get_watch_playlist', videoId=video_id, radio=True)
         songs = radio_results.get('tracks', [])
         if not songs:
             return None
@@ -31,12 +87,12 @@ class Supporting:
             for track in songs
         ]
 
-    async def get_artist(artist_name: str):
-        ytmusic = YTMusic()
-        search_results = await asyncio.to_thread(ytmusic.search, query=artist_name, filter='songs', ignore_spelling=True)
+    async def get_artist(artist_name: str, user: str = None):
+        search_results = await Supporting.upstream('search', query=artist_name, filter='songs', ignore_spelling=True)
         if not search_results:
             return None
 
+        Supporting.start_stream(search_results[0].get('videoId'), user)
         return [
             {
                 'title': track["title"],
@@ -47,9 +103,8 @@ class Supporting:
             for track in search_results
         ]
 
-    async def get_album(album_name: str):
-        ytmusic = YTMusic()
-        search_results = await asyncio.to_thread(ytmusic.search, query=album_name, filter='albums', ignore_spelling=True)
+    async def get_album(album_name: str, user: str = None):
+        search_results = await Supporting.upstream('search', query=album_name, filter='albums', ignore_spelling=True)
         if not search_results:
             return None
 
@@ -57,12 +112,18 @@ class Supporting:
         if not browse_id:
             return None
 
-        album_results = await asyncio.to_thread(ytmusic.get_album, browseId=browse_id)
+        stored = await Supporting.blocking(metadata_store.get_album, browse_id)
+        if stored:
+            Supporting.start_stream(stored[0]['video_id'], user)
+            return stored
+
+        album_results = await Supporting.upstream('get_album', browseId=browse_id)
         songs = album_results.get("tracks", [])
         if not songs:
             return None
 
-        return [
+        Supporting.start_stream(songs[0].get('videoId'), user)
+        playlist = [
             {
                 'title': track["title"],
                 'artist': " and ".join([artist["name"] for artist in track.get("artists", [])]),
@@ -71,15 +132,22 @@ class Supporting:
             }
             for track in songs
         ]
+        background.submit(metadata_store.put_album, browse_id, playlist)
+        return playlist
     
-    async def stream_playlist(playlist_id: str):
-        ytmusic = YTMusic()
-        search_results = await asyncio.to_thread(ytmusic.get_playlist, playlistId=playlist_id)
+    async def get_playlist(playlist_id: str, limit: int = 100):
+        try:
+            search_results = await Supporting.upstream('get_playlist', playlistId=playlist_id, limit=limit)
+        except UpstreamUnavailable:
+            # Any stored copy, however old, beats failing while browse is unhealthy
+            stored = await Supporting.blocking(metadata_store.get_playlist, playlist_id)
+            if stored is None: raise
+            return stored[:limit] if limit else stored
         playlist_raw = search_results['tracks']
         if not playlist_raw:
             return None
 
-        playlist = [
+        return [
             {
                 'title': track["title"],
                 'artist': " and ".join([artist["name"] for artist in track.get("artists", [])]),
@@ -88,34 +156,242 @@ class Supporting:
             }
             for track in playlist_raw
         ]
-        stream = await Supporting.get_stream(playlist[0]['video_id'])
-        return {'song_info': {'metadata': playlist[0], 'stream': stream}, 'playlist': playlist}
 
-    async def get_stream(video_id: str):    
-        command = ["yt-dlp", "--extractor-args", "youtube:player_client=ios", "--get-url", "--no-playlist", "--quiet", "-f", "ba", "-g", video_id]
-        result = subprocess.run(command, capture_output=True, text=True)
-        if result.returncode == 0:
-            url = result.stdout.strip()
-            return {'audio_url': url}
-        else: print("Error: ", result.stderr)
-
-
-    async def find_stream_list(query: str, filter: str = 'songs'):
-        if filter == 'songs':
-            playlist = await Supporting.get_radiolist(query)
-        elif filter == 'artists':
-            playlist = await Supporting.get_artist(query)
-        elif filter == 'albums':
-            playlist = await Supporting.get_album(query)
-        else:
+    async def load_full_playlist(playlist_id: str):
+        playlist = await Supporting.blocking(metadata_store.get_playlist, playlist_id, max_age=PLAYLIST_TTL)
+        if not playlist:
+            playlist = await Supporting.get_playlist(playlist_id, limit=None)
+            if playlist: background.submit(metadata_store.put_playlist, playlist_id, playlist)
+        if playlist: playlist_cache.put(playlist_id, playlist)
+        return playlist
+
+    async def get_full_playlist(playlist_id: str):
+        playlist = await playlist_cache.get_async(playlist_id)
+        if playlist is not None: return playlist
+        return await single_flight.run(f'playlist_full:{playlist_id}', lambda: Supporting.load_full_playlist(playlist_id))
+
+    async def stream_playlist(playlist_id: str, window: int = None, user: str = None):
+        if not window:
+            playlist = await single_flight.run(f'playlist:{playlist_id}', lambda: Supporting.get_playlist(playlist_id))
+            if not playlist:
+                return None
+
+            stream = await Supporting.get_stream(playlist[0]['video_id'], INTERACTIVE, user)
+            return {'song_info': {'metadata': playlist[0], 'stream': stream}, 'playlist': playlist}
+
+        # Windowed: answer with the first page right away and load the rest in the background for /playlist_window/
+        playlist = await playlist_cache.get_async(playlist_id)
+        has_more = playlist is not None and len(playlist) > window
+        complete = playlist is not None
+        if playlist is None:
+            playlist = await single_flight.run(f'playlist:{playlist_id}:{window}', lambda: Supporting.get_playlist(playlist_id, limit=window))
+            # A full first page means there may be more; the exact length is known once the background load lands
+            has_more = bool(playlist) and len(playlist) >= window
+            complete = not has_more
+            # The coroutine is only created on the background thread, so it can't be left un-awaited if the pool is shut down
+            if has_more: background.submit(lambda: asyncio.run(Supporting.get_full_playlist(playlist_id)))
+        if not playlist:
+            return None
+
+        page = playlist[:window]
+        stream = await Supporting.get_stream(page[0]['video_id'], INTERACTIVE, user)
+        # The version needs the whole playlist; when only the first page is loaded the first window carries it instead
+        version = await Supporting.playlist_version(playlist_id, playlist) if complete else None
+        next_cursor = Supporting.window_cursor(version, window) if has_more else None
+        return {'song_info': {'metadata': page[0], 'stream': stream}, 'playlist': page, 'next_cursor': next_cursor, 'version': version}
+
+    async def playlist_version(playlist_id: str, playlist: list) -> int:
+        known = playlist_versions.get(playlist_id)
+        if known is not None and known[0] is playlist: return known[2]
+        return await Supporting.blocking(Supporting.record_playlist_version, playlist_id, playlist)
+
+    def record_playlist_version(playlist_id: str, playlist: list) -> int:
+        # Another copy of the same tracks (e.g. reloaded from the backend) reuses the known version without an insert
+        keys = track_keys(playlist)
+        digest = keys_digest(keys)
+        known = playlist_versions.get(playlist_id)
+        version = known[2] if known is not None and known[1] == digest else metadata_store.put_playlist_version(playlist_id, keys)
+        playlist_versions.put(playlist_id, (playlist, digest, version))
+        return version
+
+    def window_cursor(version: int, offset: int) -> str:
+        # "<version>.<offset>" pins the paging to one snapshot; a bare offset comes from a first page sent before it was known
+        return f'{version}.{offset}' if version else str(offset)
+
+    def parse_window_cursor(cursor: str) -> tuple:
+        # (version or None, offset); anything unparsable reads as the start, like a missing cursor
+        match = re.fullmatch(r'(?:(\d+)\.)?(\d+)', cursor or '')
+        if not match: return None, 0
+        return (int(match.group(1)) if match.group(1) else None), int(match.group(2))
+
+    async def get_playlist_window(playlist_id: str, cursor: str, size: int, after: str = None):
+        playlist = await Supporting.get_full_playlist(playlist_id)
+        if not playlist:
+            return None
+
+        since, offset = Supporting.parse_window_cursor(cursor)
+        version = await Supporting.playlist_version(playlist_id, playlist)
+        # Offsets into another snapshot would skip or repeat tracks once the playlist changed: continue the current one
+        # right after `after`, the last track the client loaded, and tell it the pages it holds are from an older version
+        stale = since is not None and since != version
+        if stale: offset = Supporting.resume_offset(playlist, after, offset)
+        end = offset + size
+        next_cursor = Supporting.window_cursor(version, end) if end < len(playlist) else None
+        response = {'playlist': playlist[offset:end], 'next_cursor': next_cursor, 'total': len(playlist), 'version': version}
+        if stale: response['stale'] = True
+        return response
+
+    def resume_offset(playlist: list, after: str, offset: int) -> int:
+        # The last occurrence, so a track that also appears earlier doesn't send the client back; a removed one keeps the old offset
+        for i in range(len(playlist) - 1, -1, -1):
+            if playlist[i]['video_id'] == after: return i + 1
+        return min(offset, len(playlist))
+
+    async def get_playlist_delta(playlist_id: str, since: int = None):
+        playlist = await Supporting.get_full_playlist(playlist_id)
+        if not playlist:
+            return None
+
+        version = await Supporting.playlist_version(playlist_id, playlist)
+        if since == version: return {'version': version, 'unchanged': True}
+        old_keys = await Supporting.blocking(metadata_store.get_playlist_version, playlist_id, since) if since else None
+        # Unknown or pruned version: fall back to the whole playlist
+        if old_keys is None: return {'version': version, 'playlist': playlist}
+        return {'version': version, 'since': since, **compute_delta(old_keys, playlist)}
+
+    def submit_stream(video_id: str, priority: int = INTERACTIVE, user: str = None) -> Future:
+        # Loop agnostic entry point: resolves to the stream dict, or None if extraction gave no url
+        cached = stream_cache.get(video_id)
+        if cached:
+            future = Future()
+            future.set_result(cached)
+            return future
+        return Supporting.join_extraction(video_id, priority, user)
+
+    def join_extraction(video_id: str, priority: int = INTERACTIVE, user: str = None) -> Future:
+        # Joining a queued prefetch of the same video must not leave this caller waiting at prefetch priority
+        extraction_scheduler.promote(video_id, priority, user)
+        return single_flight.submit(f'stream:{video_id}', lambda: Supporting.extract_stream(video_id, priority, user))
+
+    def refresh_stream(video_id: str) -> Future:
+        # Re-resolves even when cached; the old url keeps being served until the new one lands
+        return single_flight.submit(f'stream:{video_id}', lambda: Supporting.extract_stream(video_id, BACKGROUND))
+
+    def extract_to_cache(video_id: str) -> Future:
+        # Cached from the pool's own future: once the extraction is running its url is kept even if every caller gave up
+        job = extraction_pool.submit(video_id)
+
+        def on_done(job: Future):
+            if job.cancelled() or job.exception() is not None or not job.result(): return
+            stream_cache.put_stream(video_id, {'audio_url': job.result()})
+        job.add_done_callback(on_done)
+        return job
+
+    def extract_stream(video_id: str, priority: int = INTERACTIVE, user: str = None) -> Future:
+        future = Future()
+        started = time.perf_counter()
+        guard = upstream_guards['extraction']
+        job = extraction_scheduler.submit(video_id, lambda: guard.submit(lambda: Supporting.extract_to_cache(video_id)), user, priority)
+
+        def on_extracted(job: Future):
+            if job.cancelled():
+                future.cancel()
+                return
+            metrics.observe_stage('extract', time.perf_counter() - started, failed=job.exception() is not None)
+            if not future.set_running_or_notify_cancel(): return
+            try:
+                url = job.result()
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            future.set_result({'audio_url': url} if url else None)
+
+        # Cancelling the returned future (e.g. an abandoned prefetch) cancels the queued extraction
+        future.add_done_callback(lambda f: f.cancelled() and job.cancel())
+        job.add_done_callback(on_extracted)
+        return future
+
+    def start_stream(video_id: str, user: str = None) -> None:
+        # Fire and forget: the get_stream for playlist[0] later joins this extraction through single_flight. Called from
+        # async views, so the cache check (a backend round trip on a local miss) runs on an io thread, not the event loop
+        if PIPELINE_FIRST_STREAM and video_id: io_calls.submit(Supporting.submit_stream, video_id, INTERACTIVE, user)
+
+    async def get_stream(video_id: str, priority: int = INTERACTIVE, user: str = None):
+        try:
+            cached = await stream_cache.get_async(video_id)
+            if cached: return cached
+            return await asyncio.wrap_future(Supporting.join_extraction(video_id, priority, user))
+        except Exception as e:
+            print("Error: ", e)
+            return None
+
+    def stream_result(video_id: str, future: Future) -> dict:
+        try:
+            stream = future.result()
+        except Exception as e:
+            return {'video_id': video_id, 'status': 'error', 'error': str(e)}
+        if not stream: return {'video_id': video_id, 'status': 'not_found'}
+        return {'video_id': video_id, 'status': 'ok', 'stream': stream, 'expires_at': StreamCache.get_url_expiry(stream['audio_url'])}
+
+
+    async def search_playlist(query: str, filter: str, user: str = None):
+        key = SearchCache.normalize(query)
+        playlist = await Supporting.blocking(metadata_store.get_query, filter, key, max_age=SearchCache.TIER_TTLS[filter])
+        if playlist is None:
+            try:
+                if filter == 'songs':
+                    playlist = await Supporting.get_radiolist(query, user)
+                elif filter == 'artists':
+                    playlist = await Supporting.get_artist(query, user)
+                elif filter == 'albums':
+                    playlist = await Supporting.get_album(query, user)
+            except UpstreamUnavailable:
+                # Serve a stale stored answer, and keep it (or the miss) out of the in-memory caches
+                return await Supporting.blocking(metadata_store.get_query, filter, key)
+            if playlist: background.submit(metadata_store.put_query, filter, key, playlist)
+        search_cache.put(filter, query, playlist)
+        return playlist
+
+    async def find_stream_list(query: str, filter: str = 'songs', user: str = None):
+        if filter not in ('songs', 'artists', 'albums'):
             raise Exception(f'Unknown filter "{filter}"')
 
+        cached, playlist = await search_cache.get_async(filter, query)
+        if not cached:
+            key = f'search:{filter}:{SearchCache.normalize(query)}'
+            playlist = await single_flight.run(key, lambda: Supporting.search_playlist(query, filter, user))
+
         if not playlist:
             return None
 
-        stream = await Supporting.get_stream(playlist[0]['video_id'])
+        stream = await Supporting.get_stream(playlist[0]['video_id'], INTERACTIVE, user)
         return {'song_info': {'metadata': playlist[0], 'stream': stream}, 'playlist': playlist}
 
+    def caches() -> dict:
+        search_tiers = {f'search_{name}': tier for name, tier in search_cache.tiers.items()}
+        return {'stream': stream_cache, 'playlist': playlist_cache, 'search_negative': search_cache.negative, **search_tiers}
+
+    def relay_enabled() -> bool:
+        # Alexa only plays https urls, so without PUBLIC_URL a ?relay=1 request keeps the googlevideo url
+        return bool(PUBLIC_URL) and (AUDIO_RELAY or request.args.get("relay") == "1")
+
+    def relay_stream(video_id: str, stream: dict) -> dict:
+        # Hand out our own /audio/ url instead of the expiring, ip bound googlevideo one; /audio/ caches the file as it plays
+        if not stream: return stream
+        return {'audio_url': f"{PUBLIC_URL.rstrip('/')}/audio/{video_id}"}
+
+    def apply_relay(response: dict) -> dict:
+        if not response or not Supporting.relay_enabled(): return response
+        song_info = response['song_info']
+        return {**response, 'song_info': {**song_info, 'stream': Supporting.relay_stream(song_info['metadata']['video_id'], song_info['stream'])}}
+
+    def prefetch_upcoming(user: str, response: dict) -> None:
+        if not response: return
+        video_ids = [track['video_id'] for track in response['playlist']]
+        if video_ids: renewal.track(video_ids[0], WEIGHT_PLAYING)
+        for video_id in video_ids[1:prefetcher.depth + 1]: renewal.track(video_id, WEIGHT_QUEUED)
+        prefetcher.schedule(user, video_ids[1:])
+
     def playlist_url_to_encoded_id(url):
         playlist_id = re.match(r"^[\w]+", url.split('list=')[-1]).group()
         return Supporting.encode_to_hex(playlist_id)
@@ -124,47 +400,204 @@ class Supporting:
         return ''.join([hex(ord(c))[2:].zfill(2) for c in string])
 
     async def get_playlist_info(playlist_id: str):
-        ytmusic = YTMusic()
-        playlist_raw = await asyncio.to_thread(ytmusic.get_playlist, playlist_id)
+        playlist_raw = await single_flight.run(f'playlist_info:{playlist_id}', lambda: Supporting.upstream('get_playlist', playlist_id))
         if not playlist_raw:
             return None
 
+        background.submit(metadata_store.put_playlist, playlist_raw['id'], title=playlist_raw['title'])
         return {'id': playlist_raw['id'], 'title': playlist_raw['title']}
+
+    def load_persisted() -> None:
+        # Refill the in-memory caches from disk with whatever ttl each entry has left
+        now = time.time()
+        for filter, query, updated_at, playlist in metadata_store.hot_queries():
+            ttl = SearchCache.TIER_TTLS[filter] - (now - updated_at)
+            if ttl > 0: search_cache.put(filter, query, playlist, ttl)
+        for playlist_id, updated_at, playlist in metadata_store.recent_playlists(PLAYLIST_TTL):
+            playlist_cache.put(playlist_id, playlist, PLAYLIST_TTL - (now - updated_at))
     
+prefetcher = Prefetcher(lambda video_id, user: Supporting.submit_stream(video_id, BACKGROUND, user), stream_cache)
+renewal = RenewalScheduler(stream_cache, Supporting.refresh_stream)
+# An extraction worker importing this module to unpickle its job must not start the server's background threads
+if not importing_in_worker(): renewal.start()
+
+warmup.add('persisted_caches', Supporting.load_persisted)
+warmup.add('ytmusic_sessions', ytmusic_pool.warm)
+# One canary per extraction worker, so every worker has its extractor and player script loaded before traffic
+warmup.add('extraction', lambda: extraction_pool.warm(WARMUP_CANARY))
+if os.environ.get('WARMUP', '1') == '1' and not importing_in_worker(): warmup.start()
+else: warmup.skip()
+
+metrics.registry.register(metrics.Gauge('ytm_cache_hit_ratio', 'Hit ratio of each in-memory cache.', ('cache',), callback=lambda: {
+    (name,): cache.stats()['hit_ratio'] for name, cache in Supporting.caches().items()
+}))
+metrics.registry.register(metrics.Gauge('ytm_cache_entries', 'Entries held by each in-memory cache.', ('cache',), callback=lambda: {
+    (name,): len(cache) for name, cache in Supporting.caches().items()
+}))
+metrics.registry.register(metrics.Gauge('ytm_extraction_queue_depth', 'Extraction jobs submitted and not yet finished.', callback=lambda: {(): extraction_pool.pending}))
+metrics.registry.register(metrics.Gauge('ytm_renewal_tracked', 'Stream urls kept fresh by the renewal scheduler.', callback=lambda: {(): renewal.stats()['tracked']}))
+metrics.registry.register(metrics.Counter('ytm_renewals_total', 'Background stream url renewals by outcome.', ('outcome',), callback=lambda: {
+    ('renewed',): renewal.renewed, ('failed',): renewal.failed
+}))
+metrics.registry.register(metrics.Gauge('ytm_upstream_concurrency_limit', 'Current adaptive concurrency limit of each upstream.', ('upstream',), callback=lambda: {
+    (name,): guard.limiter.limit for name, guard in upstream_guards.items()
+}))
+metrics.registry.register(metrics.Gauge('ytm_upstream_circuit_open', 'Whether the circuit breaker of each upstream is open.', ('upstream',), callback=lambda: {
+    (name,): int(guard.breaker.state != 'closed') for name, guard in upstream_guards.items()
+}))
+metrics.registry.register(metrics.Counter('ytm_upstream_rejected_total', 'Upstream calls failed fast by the limiter or circuit breaker.', ('upstream',), callback=lambda: {
+    (name,): guard.rejected for name, guard in upstream_guards.items()
+}))
+metrics.registry.register(metrics.Gauge('ytm_ready', 'Whether the startup warm-up has finished.', callback=lambda: {(): int(warmup.ready)}))
+metrics.registry.register(metrics.Gauge('ytm_time_to_ready_seconds', 'Seconds from startup until the warm-up finished, or so far.', callback=lambda: {(): warmup.time_to_ready}))
+metrics.registry.register(metrics.Gauge('ytm_warmup_step_seconds', 'Duration of each warm-up step.', ('step',), callback=lambda: {
+    (name,): step['seconds'] for name, step in warmup.steps.items() if 'seconds' in step
+}))
+metrics.registry.register(metrics.Gauge('ytm_extraction_scheduler_queued', 'Extractions waiting in the fair scheduler by priority class.', ('priority',), callback=lambda: {
+    (name,): count for name, count in extraction_scheduler.stats()['queued'].items()
+}))
+metrics.registry.register(metrics.Counter('ytm_deduplicated_requests_total', 'Requests served by joining an identical in-flight call.', callback=lambda: {(): single_flight.deduplicated}))
+
+
+def route_label() -> str:
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_timer():
+    g.start_time = time.perf_counter()
+    metrics.in_flight.inc(route_label())
+
+@app.after_request
+def record_timing(response):
+    elapsed = time.perf_counter() - g.get('start_time', time.perf_counter())
+    metrics.request_latency.observe(route_label(), str(response.status_code), value=elapsed)
+    response.headers['Server-Timing'] = f'app;dur={elapsed * 1000:.1f}'
+    print(f'Completed request in {elapsed:.2f} seconds.')
+    return response
+
+@app.teardown_request
+def end_request(exception=None):
+    if 'start_time' in g: metrics.in_flight.dec(route_label())
+
+
 @app.route("/get_playlist_info/", methods=["GET"])
 async def get_playlist_info():
-    start_time = time.time()
     playlist_id = request.args.get("id")
     response = await Supporting.get_playlist_info(playlist_id)
-    print(f'Completed request in {time.time() - start_time:.2f} seconds.')
-    return jsonify(response)
+    return wire.respond(request, response)
 
 @app.route("/stream_playlist/", methods=["GET"])
 async def stream_playlist():
-    start_time = time.time()
     playlist_id = request.args.get("id")
-    response = await Supporting.stream_playlist(playlist_id)
-    print(f'Completed request in {time.time() - start_time:.2f} seconds.')
-    return jsonify(response)
+    window = min(request.args.get("window", 0, type=int), MAX_WINDOW_SIZE)
+    user = request.args.get("user", request.remote_addr)
+    response = await Supporting.stream_playlist(playlist_id, window, user)
+    # Prefetch checks the stream cache, which may mean backend round trips
+    await Supporting.blocking(Supporting.prefetch_upcoming, user, response)
+    return wire.respond(request, Supporting.apply_relay(response))
+
+
+@app.route("/playlist_window/", methods=["GET"])
+async def playlist_window():
+    playlist_id = request.args.get("id")
+    cursor = request.args.get("cursor")
+    size = min(request.args.get("size", 100, type=int), MAX_WINDOW_SIZE)
+    response = await Supporting.get_playlist_window(playlist_id, cursor, size, request.args.get("after"))
+    return wire.respond(request, response)
+
+
+@app.route("/playlist_delta/", methods=["GET"])
+async def playlist_delta():
+    playlist_id = request.args.get("id")
+    since = request.args.get("since", type=int)
+    response = await Supporting.get_playlist_delta(playlist_id, since)
+    return wire.respond(request, response)
 
 
 @app.route("/get_stream/", methods=["GET"])
 async def get_stream():
-    start_time = time.time()
     video_id = request.args.get("video_id")
-    response = await Supporting.get_stream(video_id)
-    print(f'Completed request in {time.time() - start_time:.2f} seconds.')
-    return jsonify(response)
+    priority = PRIORITIES.get(request.args.get("priority"), INTERACTIVE)
+    response = await Supporting.get_stream(video_id, priority, request.args.get("user", request.remote_addr))
+    if response: renewal.track(video_id, WEIGHT_PLAYING)
+    if Supporting.relay_enabled(): response = Supporting.relay_stream(video_id, response)
+    return wire.respond(request, response)
+
+
+@app.route("/audio/<video_id>", methods=["GET", "HEAD"])
+def audio(video_id):
+    if not is_video_id(video_id): return Response(status=404)
+    cached = audio_relay.cache.lookup(video_id)
+    if cached: return send_file(cached.path, mimetype=cached.mimetype, conditional=True, max_age=86400)
+
+    try:
+        stream = Supporting.submit_stream(video_id, INTERACTIVE, request.args.get("user", request.remote_addr)).result()
+    except Exception as e:
+        print("Error: ", e)
+        stream = None
+    if not stream: return Response(status=404)
+    return audio_relay.proxy(stream['audio_url'], request.headers.get("Range"), video_id if request.method == "GET" else None)
+
+
+@app.route("/get_streams/", methods=["GET", "POST"])
+def get_streams():
+    if request.method == "POST": video_ids = (request.get_json(silent=True) or {}).get("video_ids", [])
+    else: video_ids = request.args.get("video_ids", "").split(",")
+    video_ids = list(dict.fromkeys(i.strip() for i in video_ids if i and i.strip()))[:MAX_BATCH_SIZE]
+    # Batches are look-ahead for upcoming tracks, so they queue behind interactive requests unless told otherwise
+    priority = PRIORITIES.get(request.args.get("priority"), ENQUEUE)
+    user = request.args.get("user", request.remote_addr)
+    futures = {Supporting.submit_stream(video_id, priority, user): video_id for video_id in video_ids}
+    for video_id in video_ids: renewal.track(video_id, WEIGHT_BATCH)
+
+    if request.args.get("stream", "1") == "0":
+        results = {video_id: Supporting.stream_result(video_id, future) for future, video_id in futures.items()}
+        return jsonify({'streams': [results[video_id] for video_id in video_ids]})
+
+    # Newline delimited json, one line per video_id in completion order
+    def generate():
+        for future in as_completed(futures):
+            yield json.dumps(Supporting.stream_result(futures[future], future)) + "\n"
+    return Response(generate(), mimetype="application/x-ndjson")
 
 
 @app.route("/find_stream_list/", methods=["GET"])
 async def find_stream_list():
-    start_time = time.time()
     query = request.args.get("query")
     filter = request.args.get("filter")
-    response = await Supporting.find_stream_list(query, filter)
-    print(f'Completed request in {time.time() - start_time:.2f} seconds.')
-    return jsonify(response)
+    user = request.args.get("user", request.remote_addr)
+    response = await Supporting.find_stream_list(query, filter, user)
+    await Supporting.blocking(Supporting.prefetch_upcoming, user, response)
+    return wire.respond(request, Supporting.apply_relay(response))
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    # Readiness: 503 until the warm-up has run, so a load balancer keeps cold instances out of rotation
+    return jsonify(warmup.status()), 200 if warmup.ready else 503
+
+
+@app.route("/stats/", methods=["GET"])
+def stats():
+    return jsonify({
+        'stream_cache': stream_cache.stats(),
+        'cache_backend': cache_backend.stats() if cache_backend else None,
+        'search_cache': search_cache.stats(),
+        'ytmusic_pool': ytmusic_pool.stats(),
+        'prefetch': prefetcher.stats(),
+        'single_flight': single_flight.stats(),
+        'metadata_store': metadata_store.stats(),
+        'audio_relay': audio_relay.stats(),
+        'renewal': renewal.stats(),
+        'extraction_scheduler': extraction_scheduler.stats(),
+        'upstreams': {name: guard.stats() for name, guard in upstream_guards.items()},
+        'extraction': {'workers': extraction_pool.workers, 'in_process': extraction_pool.in_process, 'pending': extraction_pool.pending}
+    })
 
 
 @app.route("/setup/", methods=["GET", "POST"])
@@ -0,0 +1,87 @@
+import asyncio, threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Hashable
+
+def _copy_outcome(source: Future, target: Future) -> None:
+    if target.done(): return
+    if source.cancelled(): target.cancel()
+    elif source.exception() is not None: target.set_exception(source.exception())
+    else: target.set_result(source.result())
+
+
+class _Call:
+    def __init__(self):
+        self.result = Future()
+        self.source = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent identical requests so they share one upstream call, across threads and event loops."""
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.deduplicated = 0
+
+    def _join(self, key: Hashable):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.deduplicated += 1
+            call.waiters += 1
+        return call, is_leader
+
+    def _settle(self, key: Hashable, call: _Call, source: Future) -> None:
+        # Forget the key before publishing, so requests arriving afterwards start fresh
+        with self._lock:
+            if self._calls.get(key) is call: del self._calls[key]
+        _copy_outcome(source, call.result)
+
+    def _waiter(self, call: _Call) -> Future:
+        # Each caller gets its own future; the shared call is only cancelled once every caller gave up
+        waiter = Future()
+        call.result.add_done_callback(lambda f: _copy_outcome(f, waiter))
+
+        def on_waiter_done(f: Future):
+            if not f.cancelled(): return
+            with self._lock:
+                call.waiters -= 1
+                abandoned = call.waiters == 0
+            if abandoned and call.source is not None: call.source.cancel()
+        waiter.add_done_callback(on_waiter_done)
+        return waiter
+
+    def submit(self, key: Hashable, start: Callable[[], Future]) -> Future:
+        call, is_leader = self._join(key)
+        waiter = self._waiter(call)
+        if is_leader:
+            try:
+                call.source = start()
+            except BaseException as e:
+                call.source = Future()
+                call.source.set_exception(e)
+            call.source.add_done_callback(lambda f: self._settle(key, call, f))
+        return waiter
+
+    async def run(self, key: Hashable, start: Callable[[], Awaitable]):
+        call, is_leader = self._join(key)
+        if not is_leader: return await asyncio.wrap_future(self._waiter(call))
+
+        source = Future()
+        call.source = source
+        source.set_running_or_notify_cancel()
+        try:
+            source.set_result(await start())
+        except BaseException as e:
+            source.set_exception(e)
+        finally:
+            self._settle(key, call, source)
+        return source.result()
+
+    def stats(self) -> dict:
+        return {'in_flight': len(self._calls), 'leaders': self.leaders, 'deduplicated': self.deduplicated}
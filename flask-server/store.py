@@ -0,0 +1,163 @@
+import json, os, sqlite3, threading, time
+from typing import Dict, Iterator, List, Optional, Tuple
+from sync import keys_digest
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    video_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    thumbnail TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS albums (
+    browse_id TEXT PRIMARY KEY,
+    video_ids TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS playlists (
+    playlist_id TEXT PRIMARY KEY,
+    title TEXT,
+    video_ids TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS queries (
+    filter TEXT NOT NULL,
+    query TEXT NOT NULL,
+    video_ids TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (filter, query)
+);
+CREATE TABLE IF NOT EXISTS playlist_versions (
+    playlist_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    track_keys TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (playlist_id, version)
+);
+CREATE INDEX IF NOT EXISTS queries_hot ON queries (hits DESC, updated_at DESC);
+"""
+
+class MetadataStore:
+    """On-disk (SQLite, WAL) store of tracks, albums, playlists and query results, so restarts come back warm."""
+    HIT_FLUSH_EVERY = 64
+
+    def __init__(self, path: str = None):
+        self.path = path or os.environ.get('METADATA_DB') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metadata.db')
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        self._hits: Dict[Tuple[str, str], int] = {}
+        self._hits_lock = threading.Lock()
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock, self._db:
+            return self._db.execute(sql, params).fetchall()
+
+    def put_tracks(self, playlist: List[Dict]) -> None:
+        now = time.time()
+        rows = [(t['video_id'], t['title'], t['artist'], json.dumps(t.get('thumbnail')), now) for t in playlist]
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?)', rows)
+
+    def get_tracks(self, video_ids: List[str]) -> Optional[List[Dict]]:
+        # All or nothing, in the requested order
+        tracks = {}
+        for offset in range(0, len(video_ids), 500):
+            chunk = video_ids[offset:offset + 500]
+            rows = self._execute(f"SELECT video_id, title, artist, thumbnail FROM tracks WHERE video_id IN ({','.join('?' * len(chunk))})", tuple(chunk))
+            for video_id, title, artist, thumbnail in rows:
+                tracks[video_id] = {'title': title, 'artist': artist, 'video_id': video_id, 'thumbnail': json.loads(thumbnail)}
+        if any(video_id not in tracks for video_id in video_ids): return None
+        return [tracks[video_id] for video_id in video_ids]
+
+    def _get_list(self, sql: str, params: tuple, max_age: float = None) -> Optional[List[Dict]]:
+        rows = self._execute(sql, params)
+        if not rows or rows[0][0] is None: return None
+        video_ids, updated_at = rows[0]
+        if max_age is not None and time.time() - updated_at > max_age: return None
+        return self.get_tracks(json.loads(video_ids))
+
+    def put_query(self, filter: str, query: str, playlist: List[Dict]) -> None:
+        self.put_tracks(playlist)
+        video_ids = json.dumps([t['video_id'] for t in playlist])
+        self._execute(
+            'INSERT INTO queries (filter, query, video_ids, updated_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (filter, query) DO UPDATE SET video_ids = excluded.video_ids, updated_at = excluded.updated_at',
+            (filter, query, video_ids, time.time())
+        )
+
+    def get_query(self, filter: str, query: str, max_age: float = None) -> Optional[List[Dict]]:
+        playlist = self._get_list('SELECT video_ids, updated_at FROM queries WHERE filter = ? AND query = ?', (filter, query), max_age)
+        if playlist: self._count_hit(filter, query)
+        return playlist
+
+    def _count_hit(self, filter: str, query: str) -> None:
+        # Hits only rank hot_queries for the next warm start, so they're written in batches rather than per read
+        with self._hits_lock:
+            self._hits[(filter, query)] = self._hits.get((filter, query), 0) + 1
+            flush = sum(self._hits.values()) >= MetadataStore.HIT_FLUSH_EVERY
+        if flush: self.flush_hits()
+
+    def flush_hits(self) -> None:
+        with self._hits_lock:
+            hits, self._hits = self._hits, {}
+        if not hits: return
+        with self._lock, self._db:
+            self._db.executemany('UPDATE queries SET hits = hits + ? WHERE filter = ? AND query = ?', [(n, f, q) for (f, q), n in hits.items()])
+
+    def hot_queries(self, limit: int = 200) -> Iterator[Tuple[str, str, float, List[Dict]]]:
+        self.flush_hits()
+        for filter, query, updated_at in self._execute('SELECT filter, query, updated_at FROM queries ORDER BY hits DESC, updated_at DESC LIMIT ?', (limit,)):
+            playlist = self._get_list('SELECT video_ids, updated_at FROM queries WHERE filter = ? AND query = ?', (filter, query))
+            if playlist: yield filter, query, updated_at, playlist
+
+    def put_album(self, browse_id: str, playlist: List[Dict]) -> None:
+        self.put_tracks(playlist)
+        self._execute('INSERT OR REPLACE INTO albums VALUES (?, ?, ?)', (browse_id, json.dumps([t['video_id'] for t in playlist]), time.time()))
+
+    def get_album(self, browse_id: str) -> Optional[List[Dict]]:
+        return self._get_list('SELECT video_ids, updated_at FROM albums WHERE browse_id = ?', (browse_id,))
+
+    def put_playlist(self, playlist_id: str, playlist: List[Dict] = None, title: str = None) -> None:
+        if playlist is not None: self.put_tracks(playlist)
+        video_ids = json.dumps([t['video_id'] for t in playlist]) if playlist is not None else None
+        self._execute(
+            'INSERT INTO playlists (playlist_id, title, video_ids, updated_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (playlist_id) DO UPDATE SET title = COALESCE(excluded.title, title), '
+            'video_ids = COALESCE(excluded.video_ids, video_ids), '
+            'updated_at = CASE WHEN excluded.video_ids IS NULL THEN updated_at ELSE excluded.updated_at END',
+            (playlist_id, title, video_ids, time.time())
+        )
+
+    def get_playlist(self, playlist_id: str, max_age: float = None) -> Optional[List[Dict]]:
+        return self._get_list('SELECT video_ids, updated_at FROM playlists WHERE playlist_id = ?', (playlist_id,), max_age)
+
+    def put_playlist_version(self, playlist_id: str, track_keys: List[str], keep: int = 20) -> int:
+        # A new version is only recorded when the track keys differ from the latest snapshot
+        digest = keys_digest(track_keys)
+        with self._lock, self._db:
+            row = self._db.execute('SELECT version, digest FROM playlist_versions WHERE playlist_id = ? ORDER BY version DESC LIMIT 1', (playlist_id,)).fetchone()
+            if row and row[1] == digest: return row[0]
+            version = row[0] + 1 if row else 1
+            self._db.execute('INSERT INTO playlist_versions VALUES (?, ?, ?, ?, ?)', (playlist_id, version, digest, json.dumps(track_keys), time.time()))
+            self._db.execute('DELETE FROM playlist_versions WHERE playlist_id = ? AND version <= ?', (playlist_id, version - keep))
+        return version
+
+    def get_playlist_version(self, playlist_id: str, version: int) -> Optional[List[str]]:
+        rows = self._execute('SELECT track_keys FROM playlist_versions WHERE playlist_id = ? AND version = ?', (playlist_id, version))
+        return json.loads(rows[0][0]) if rows else None
+
+    def recent_playlists(self, max_age: float, limit: int = 32) -> Iterator[Tuple[str, float, List[Dict]]]:
+        rows = self._execute('SELECT playlist_id, updated_at FROM playlists WHERE video_ids IS NOT NULL AND updated_at > ? ORDER BY updated_at DESC LIMIT ?', (time.time() - max_age, limit))
+        for playlist_id, updated_at in rows:
+            playlist = self.get_playlist(playlist_id)
+            if playlist: yield playlist_id, updated_at, playlist
+
+    def stats(self) -> Dict:
+        counts = {table: self._execute(f'SELECT COUNT(*) FROM {table}')[0][0] for table in ('tracks', 'albums', 'playlists', 'queries')}
+        return {'path': self.path, **counts}
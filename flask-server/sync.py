@@ -0,0 +1,68 @@
+import bisect, hashlib
+from typing import Dict, List
+
+def track_hash(track: Dict) -> str:
+    thumbnail = track.get('thumbnail') or {}
+    content = '\x1f'.join([track['video_id'], track['title'], track['artist'], thumbnail.get('url') or ''])
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=6).hexdigest()
+
+def track_keys(playlist: List[Dict]) -> List[str]:
+    # Playlists may repeat a track, so the n-th occurrence of a hash gets its own key
+    seen, keys = {}, []
+    for track in playlist:
+        digest = track_hash(track)
+        seen[digest] = seen.get(digest, 0) + 1
+        keys.append(digest if seen[digest] == 1 else f'{digest}.{seen[digest]}')
+    return keys
+
+def keys_digest(keys: List[str]) -> str:
+    # Identifies a playlist snapshot; two playlists with the same digest need no new version
+    return hashlib.sha1('\n'.join(keys).encode('utf-8')).hexdigest()
+
+def _stable_positions(old_positions: List[int]) -> set:
+    # Longest increasing subsequence of old positions: those tracks keep their relative order and need no move
+    tails, tails_at, parents = [], [], [None] * len(old_positions)
+    for i, position in enumerate(old_positions):
+        slot = bisect.bisect_left(tails, position)
+        if slot: parents[i] = tails_at[slot - 1]
+        if slot == len(tails):
+            tails.append(position)
+            tails_at.append(i)
+        else:
+            tails[slot] = position
+            tails_at[slot] = i
+    stable, i = set(), tails_at[-1] if tails_at else None
+    while i is not None:
+        stable.add(i)
+        i = parents[i]
+    return stable
+
+def compute_delta(old_keys: List[str], playlist: List[Dict]) -> Dict:
+    """Delta turning the snapshot `old_keys` into `playlist`: drop `removed` and moved keys, then apply `inserted` in order."""
+    new_keys = track_keys(playlist)
+    old_index = {key: i for i, key in enumerate(old_keys)}
+    new_set = set(new_keys)
+
+    common = [i for i, key in enumerate(new_keys) if key in old_index]
+    stable = {common[i] for i in _stable_positions([old_index[new_keys[i]] for i in common])}
+
+    inserted = []
+    for i, key in enumerate(new_keys):
+        if i in stable: continue
+        if key in old_index: inserted.append([i, key])
+        else: inserted.append([i, key, playlist[i]])
+    return {
+        'removed': [key for key in old_keys if key not in new_set],
+        'moved': len([row for row in inserted if len(row) == 2]),
+        'inserted': inserted,
+        'count': len(new_keys)
+    }
+
+def apply_delta(old_playlist: List[Dict], delta: Dict) -> List[Dict]:
+    by_key = dict(zip(track_keys(old_playlist), old_playlist))
+    moved = {row[1] for row in delta['inserted'] if len(row) == 2}
+    drop = set(delta['removed']) | moved
+    playlist = [track for key, track in by_key.items() if key not in drop]
+    for row in delta['inserted']:
+        playlist.insert(row[0], row[2] if len(row) == 3 else by_key[row[1]])
+    return playlist
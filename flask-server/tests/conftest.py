@@ -0,0 +1,4 @@
+import os, sys
+
+# The server modules are imported as top-level modules, the way server.py imports them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,30 @@
+import time
+import pytest
+from caching import StreamCache
+
+def url(expires_at: float, path_style: bool = False) -> str:
+    if path_style: return f'https://rr1.googlevideo.com/videoplayback/id/abc/expire/{int(expires_at)}/ip/1.2.3.4'
+    return f'https://rr1.googlevideo.com/videoplayback?id=abc&expire={int(expires_at)}&ip=1.2.3.4'
+
+@pytest.mark.parametrize('path_style', [False, True])
+def test_expiry_is_read_from_query_or_path(path_style):
+    assert StreamCache.get_url_expiry(url(1700000000, path_style)) == 1700000000
+    assert StreamCache.get_url_expiry('https://example.org/audio/abc') is None
+
+def test_ttl_ends_a_safety_margin_before_the_url_expires():
+    cache = StreamCache(safety_margin=600)
+    expires_at = time.time() + 6 * 3600
+    cache.put_stream('abc', {'audio_url': url(expires_at)})
+    assert cache.expires_at('abc') == pytest.approx(int(expires_at) - 600, abs=2)
+    assert cache.get('abc') == {'audio_url': url(expires_at)}
+
+def test_urls_inside_the_safety_margin_are_not_cached():
+    cache = StreamCache(safety_margin=600)
+    cache.put_stream('abc', {'audio_url': url(time.time() + 300)})
+    assert cache.get('abc') is None
+
+def test_urls_without_expiry_use_the_fallback_ttl():
+    cache = StreamCache(fallback_ttl=1800)
+    now = time.time()
+    cache.put_stream('abc', {'audio_url': 'https://example.org/audio/abc'})
+    assert cache.expires_at('abc') == pytest.approx(now + 1800, abs=2)
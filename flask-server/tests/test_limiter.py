@@ -0,0 +1,109 @@
+import socket, time
+from concurrent.futures import Future
+from limiter import AdaptiveLimiter, CircuitBreaker, Overloaded, UpstreamGuard, UpstreamUnavailable, is_upstream_failure
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.threshold): breaker.record(failed=True)
+
+def test_breaker_opens_after_threshold_consecutive_failures():
+    breaker = CircuitBreaker(threshold=3, reset_timeout=30)
+    breaker.record(failed=True)
+    breaker.record(failed=True)
+    breaker.record(failed=False)
+    breaker.record(failed=True)
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.record(failed=True)
+    breaker.record(failed=True)
+    assert breaker.state == 'open' and breaker.trips == 1
+    assert not breaker.allow()
+
+def test_breaker_half_opens_for_a_single_probe_after_the_timeout():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 30
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow()
+
+def test_successful_probe_closes_the_breaker():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 30
+    breaker.allow()
+    breaker.record(failed=False)
+    assert breaker.state == 'closed' and breaker.failures == 0
+    assert breaker.allow() and breaker.allow()
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 30
+    breaker.allow()
+    breaker.record(failed=True)
+    assert breaker.state == 'open' and breaker.trips == 2
+    assert not breaker.allow()
+
+def test_only_upstream_side_errors_are_failures():
+    assert is_upstream_failure(socket.timeout('timed out'))
+    assert is_upstream_failure(ConnectionResetError())
+    assert is_upstream_failure(Exception('ERROR: unable to download webpage: HTTP Error 429: Too Many Requests'))
+    assert is_upstream_failure(Exception('Server returned HTTP 503: Service Unavailable'))
+    assert not is_upstream_failure(Exception('ERROR: [youtube] abc: Video unavailable'))
+    assert not is_upstream_failure(Exception('HTTP Error 404: Not Found'))
+    assert not is_upstream_failure(KeyError('videoId'))
+
+def test_guard_opens_its_circuit_on_upstream_errors_only():
+    guard = UpstreamGuard('test', AdaptiveLimiter(initial=1), CircuitBreaker(threshold=2))
+
+    def failing(error: Exception):
+        def start():
+            future = Future()
+            future.set_exception(error)
+            return future
+        return start
+
+    for _ in range(3): guard.submit(failing(Exception('Video unavailable')))
+    assert guard.breaker.state == 'closed'
+    for _ in range(2): guard.submit(failing(TimeoutError()))
+    assert guard.breaker.state == 'open'
+    assert isinstance(guard.submit(failing(TimeoutError())).exception(), UpstreamUnavailable)
+
+def half_open_guard(**kwargs) -> UpstreamGuard:
+    guard = UpstreamGuard('test', AdaptiveLimiter(initial=1, max_limit=1), CircuitBreaker(threshold=1, reset_timeout=30), **kwargs)
+    guard.breaker.record(failed=True)
+    guard.breaker.opened_at -= 30
+    return guard
+
+def pending():
+    inner = Future()
+    return inner, lambda: inner
+
+def test_cancelled_probe_releases_the_half_open_circuit():
+    guard = half_open_guard()
+    inner, start = pending()
+    probe = guard.submit(start)
+    assert isinstance(guard.submit(start).exception(), UpstreamUnavailable)
+    probe.cancel()
+    assert inner.cancelled()
+    assert guard.breaker.state == 'half_open'
+    next_inner, next_start = pending()
+    next_probe = guard.submit(next_start)
+    assert not next_probe.done()
+    next_inner.set_result('ok')
+    assert next_probe.result() == 'ok' and guard.breaker.state == 'closed'
+
+def test_probe_expiring_in_the_queue_releases_the_half_open_circuit():
+    guard = half_open_guard(max_wait=0.01)
+    # A call admitted before the circuit opened still holds the only slot
+    guard.breaker.state = 'closed'
+    running, start_running = pending()
+    guard.submit(start_running)
+    guard.breaker.state = 'half_open'
+
+    probe_inner, start_probe = pending()
+    probe = guard.submit(start_probe)
+    time.sleep(0.02)
+    running.cancel()
+    assert isinstance(probe.exception(), Overloaded)
+    assert guard.breaker.state == 'half_open'
+    assert guard.breaker.allow()
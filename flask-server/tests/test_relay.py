@@ -0,0 +1,55 @@
+import io, re
+import requests
+import relay
+from relay import AudioCache, AudioRelay
+
+VIDEO_ID = 'dQw4w9WgXcQ'
+AUDIO = bytes(range(256)) * 10
+
+class FakeUpstream:
+    """Answers ranged reads of AUDIO, optionally leaving the total out of the Content-Range (bytes a-b/*)."""
+    def __init__(self, send_total: bool = True, cut_at: int = None):
+        self.send_total = send_total
+        self.cut_at = cut_at
+        self.ranges = []
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        first, last = map(int, re.match(r'bytes=(\d+)-(\d+)', headers['Range']).groups())
+        self.ranges.append(first)
+        body = AUDIO[:self.cut_at][first:last + 1]
+        response = requests.Response()
+        response.status_code = 206 if body else 416
+        if body: response.headers['Content-Range'] = f"bytes {first}-{first + len(body) - 1}/{len(AUDIO) if self.send_total else '*'}"
+        response.raw = io.BytesIO(body)
+        return response
+
+def download(tmp_path, monkeypatch, upstream: FakeUpstream) -> AudioCache:
+    monkeypatch.setattr(relay, 'CHUNK_SIZE', 1000)
+    cache = AudioCache(str(tmp_path), max_bytes=10 ** 6)
+    audio_relay = AudioRelay(cache)
+    audio_relay.session = upstream
+    audio_relay._download(VIDEO_ID, 'https://rr1.googlevideo.com/videoplayback?mime=audio%2Fwebm')
+    return cache
+
+def test_download_stops_at_the_total_size(tmp_path, monkeypatch):
+    upstream = FakeUpstream()
+    entry = download(tmp_path, monkeypatch, upstream).lookup(VIDEO_ID)
+    assert upstream.ranges == [0, 1000, 2000]
+    assert open(entry.path, 'rb').read() == AUDIO
+
+def test_download_without_a_total_continues_until_a_short_range(tmp_path, monkeypatch):
+    upstream = FakeUpstream(send_total=False)
+    entry = download(tmp_path, monkeypatch, upstream).lookup(VIDEO_ID)
+    assert upstream.ranges == [0, 1000, 2000]
+    assert open(entry.path, 'rb').read() == AUDIO
+
+def test_download_without_a_total_ends_on_an_empty_range(tmp_path, monkeypatch):
+    upstream = FakeUpstream(send_total=False, cut_at=2000)
+    entry = download(tmp_path, monkeypatch, upstream).lookup(VIDEO_ID)
+    assert upstream.ranges == [0, 1000, 2000]
+    assert open(entry.path, 'rb').read() == AUDIO[:2000]
+
+def test_download_cut_short_of_the_total_is_not_committed(tmp_path, monkeypatch):
+    cache = download(tmp_path, monkeypatch, FakeUpstream(cut_at=1500))
+    assert cache.lookup(VIDEO_ID) is None
+    assert not (tmp_path / f'{VIDEO_ID}.part').exists()
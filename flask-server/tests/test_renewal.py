@@ -0,0 +1,50 @@
+import time
+from concurrent.futures import Future
+from caching import StreamCache
+from renewal import RenewalScheduler, WEIGHT_PLAYING, WEIGHT_QUEUED
+
+def url(expires_in: float) -> str:
+    return f'https://rr1.googlevideo.com/videoplayback?id=abc&expire={int(time.time() + expires_in)}'
+
+def scheduler(refresh=None) -> RenewalScheduler:
+    return RenewalScheduler(StreamCache(safety_margin=0), refresh or (lambda video_id: Future()), lead_time=900, burst=100)
+
+def test_only_cached_entries_close_to_expiry_are_due():
+    renewal = scheduler()
+    renewal.cache.put_stream('soon', {'audio_url': url(600)})
+    renewal.cache.put_stream('later', {'audio_url': url(6 * 3600)})
+    for video_id in ('soon', 'later', 'never_cached'): renewal.track(video_id, WEIGHT_PLAYING)
+    renewal.track('cancelled_prefetch', WEIGHT_QUEUED)
+    assert renewal.due() == ['soon']
+
+def test_failed_or_empty_refresh_stops_tracking():
+    results = {}
+    def refresh(video_id):
+        results[video_id] = Future()
+        return results[video_id]
+    renewal = scheduler(refresh)
+    for video_id in ('ok', 'unavailable', 'not_found'):
+        renewal.cache.put_stream(video_id, {'audio_url': url(600)})
+        renewal.track(video_id)
+    assert renewal.run_once() == 3
+    assert renewal.due() == []
+
+    results['ok'].set_result({'audio_url': url(6 * 3600)})
+    results['unavailable'].set_exception(Exception('Video unavailable'))
+    results['not_found'].set_result(None)
+    assert renewal.stats() == {'tracked': 1, 'in_flight': 0, 'renewed': 1, 'failed': 2}
+
+def test_refresh_still_queued_after_its_url_lapsed_is_cancelled():
+    results = {}
+    def refresh(video_id):
+        results[video_id] = Future()
+        return results[video_id]
+    renewal = scheduler(refresh)
+    renewal.cache.put_stream('waiting', {'audio_url': url(600)})
+    renewal.track('waiting')
+    assert renewal.run_once() == 1
+
+    renewal.cache.pop('waiting')
+    renewal.due()
+    assert results['waiting'].cancelled()
+    assert renewal.stats()['in_flight'] == 0
@@ -0,0 +1,84 @@
+from concurrent.futures import Future
+from scheduler import FairScheduler, INTERACTIVE, ENQUEUE, BACKGROUND
+
+class Recorder:
+    """Job starts that stay running until finish() is called, remembering the order they were started in."""
+    def __init__(self):
+        self.started = []
+        self.inner = {}
+
+    def start(self, key: str):
+        def start():
+            self.started.append(key)
+            self.inner[key] = Future()
+            return self.inner[key]
+        return start
+
+    def finish(self, key: str) -> None:
+        self.inner[key].set_result(key)
+
+def test_jobs_start_by_priority_class():
+    jobs = Recorder()
+    scheduler = FairScheduler(lambda: 1, reserved=0)
+    scheduler.submit('blocker', jobs.start('blocker'))
+    scheduler.submit('bg', jobs.start('bg'), priority=BACKGROUND)
+    scheduler.submit('enq', jobs.start('enq'), priority=ENQUEUE)
+    scheduler.submit('int', jobs.start('int'), priority=INTERACTIVE)
+    for key in ('blocker', 'int', 'enq'): jobs.finish(key)
+    assert jobs.started == ['blocker', 'int', 'enq', 'bg']
+
+def test_users_take_turns_within_a_class():
+    jobs = Recorder()
+    scheduler = FairScheduler(lambda: 1, reserved=0)
+    scheduler.submit('blocker', jobs.start('blocker'))
+    for key in ('a1', 'a2', 'a3'): scheduler.submit(key, jobs.start(key), user='a')
+    for key in ('b1', 'b2'): scheduler.submit(key, jobs.start(key), user='b')
+    scheduler.submit('c1', jobs.start('c1'), user='c')
+    for key in ('blocker', 'a1', 'b1', 'c1', 'a2', 'b2'): jobs.finish(key)
+    assert jobs.started == ['blocker', 'a1', 'b1', 'c1', 'a2', 'b2', 'a3']
+
+def test_reserved_slot_is_kept_from_background_work():
+    jobs = Recorder()
+    scheduler = FairScheduler(lambda: 2, reserved=1)
+    scheduler.submit('bg1', jobs.start('bg1'), priority=BACKGROUND)
+    scheduler.submit('bg2', jobs.start('bg2'), priority=BACKGROUND)
+    assert jobs.started == ['bg1']
+    scheduler.submit('int', jobs.start('int'))
+    assert jobs.started == ['bg1', 'int']
+
+def test_background_waits_when_capacity_is_only_the_reserved_slot():
+    jobs = Recorder()
+    scheduler = FairScheduler(lambda: 1, reserved=1)
+    scheduler.submit('bg', jobs.start('bg'), priority=BACKGROUND)
+    assert jobs.started == []
+    scheduler.submit('int', jobs.start('int'))
+    assert jobs.started == ['int']
+
+def test_promoted_job_moves_to_the_front_class():
+    jobs = Recorder()
+    scheduler = FairScheduler(lambda: 1, reserved=0)
+    scheduler.submit('blocker', jobs.start('blocker'))
+    scheduler.submit('enq', jobs.start('enq'), priority=ENQUEUE)
+    scheduler.submit('prefetch', jobs.start('prefetch'), priority=BACKGROUND)
+    scheduler.promote('prefetch', INTERACTIVE, user='listener')
+    jobs.finish('blocker')
+    assert jobs.started == ['blocker', 'prefetch']
+
+def test_cancelled_queued_jobs_are_skipped():
+    jobs = Recorder()
+    scheduler = FairScheduler(lambda: 1, reserved=0)
+    scheduler.submit('blocker', jobs.start('blocker'))
+    scheduler.submit('gone', jobs.start('gone')).cancel()
+    scheduler.submit('next', jobs.start('next'))
+    jobs.finish('blocker')
+    assert jobs.started == ['blocker', 'next']
+
+def test_cancelled_background_jobs_leave_the_queue_without_a_slot():
+    jobs = Recorder()
+    scheduler = FairScheduler(lambda: 1, reserved=1)
+    for key in ('bg1', 'bg2', 'bg3'): scheduler.submit(key, jobs.start(key), user='a', priority=BACKGROUND).cancel()
+    assert scheduler.stats()['queued']['background'] == 0
+    assert scheduler.stats()['waiting_users'] == 0
+    scheduler.submit('bg1', jobs.start('bg1'), priority=BACKGROUND)
+    scheduler.promote('bg1', INTERACTIVE)
+    assert jobs.started == ['bg1']
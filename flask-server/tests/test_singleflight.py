@@ -0,0 +1,68 @@
+import asyncio
+from concurrent.futures import Future
+from singleflight import SingleFlight
+
+def shared_call():
+    calls = []
+    def start():
+        calls.append(Future())
+        return calls[-1]
+    return calls, start
+
+def test_waiters_share_one_call():
+    single_flight = SingleFlight()
+    calls, start = shared_call()
+    waiters = [single_flight.submit('key', start) for _ in range(3)]
+    assert len(calls) == 1
+    calls[0].set_result('url')
+    assert [w.result() for w in waiters] == ['url'] * 3
+    assert single_flight.stats() == {'in_flight': 0, 'leaders': 1, 'deduplicated': 2}
+
+def test_call_survives_until_the_last_waiter_cancels():
+    single_flight = SingleFlight()
+    calls, start = shared_call()
+    first, second, third = (single_flight.submit('key', start) for _ in range(3))
+    first.cancel()
+    second.cancel()
+    assert not calls[0].cancelled()
+    calls[0].set_result('url')
+    assert third.result() == 'url'
+    assert first.cancelled() and second.cancelled()
+
+def test_call_is_cancelled_once_every_waiter_gave_up():
+    single_flight = SingleFlight()
+    calls, start = shared_call()
+    waiters = [single_flight.submit('key', start) for _ in range(3)]
+    for waiter in waiters: waiter.cancel()
+    assert calls[0].cancelled()
+    # The key is free again: a new caller starts a fresh call instead of joining the cancelled one
+    fresh = single_flight.submit('key', start)
+    assert len(calls) == 2 and not fresh.done()
+
+def test_errors_reach_every_waiter():
+    single_flight = SingleFlight()
+    calls, start = shared_call()
+    waiters = [single_flight.submit('key', start) for _ in range(2)]
+    calls[0].set_exception(TimeoutError('slow'))
+    assert all(isinstance(w.exception(), TimeoutError) for w in waiters)
+
+def test_run_coalesces_coroutines_and_a_cancelled_follower_leaves_the_leader_running():
+    single_flight = SingleFlight()
+    started = []
+
+    async def load():
+        started.append(1)
+        await asyncio.sleep(0.05)
+        return 'playlist'
+
+    async def main():
+        leader = asyncio.ensure_future(single_flight.run('key', load))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(single_flight.run('key', load)) for _ in range(2)]
+        await asyncio.sleep(0)
+        followers[0].cancel()
+        return await leader, await followers[1], followers[0]
+
+    leader, follower, cancelled = asyncio.run(main())
+    assert (leader, follower) == ('playlist', 'playlist')
+    assert cancelled.cancelled() and len(started) == 1
@@ -0,0 +1,46 @@
+import random
+import pytest
+from sync import apply_delta, compute_delta, track_keys
+
+def track(video_id: str, title: str = None) -> dict:
+    return {'video_id': video_id, 'title': title or f'title {video_id}', 'artist': 'artist', 'thumbnail': {'url': f'https://img/{video_id}', 'width': 60, 'height': 60}}
+
+def round_trip(old: list, new: list) -> dict:
+    delta = compute_delta(track_keys(old), new)
+    assert apply_delta(old, delta) == new
+    return delta
+
+def test_unchanged_playlist_has_an_empty_delta():
+    playlist = [track(f'v{i}') for i in range(5)]
+    delta = round_trip(playlist, list(playlist))
+    assert delta == {'removed': [], 'moved': 0, 'inserted': [], 'count': 5}
+
+def test_insert_remove_and_edit():
+    old = [track(f'v{i}') for i in range(6)]
+    new = [old[0], track('new'), old[2], old[3], track('v4', 'renamed'), old[5]]
+    delta = round_trip(old, new)
+    assert delta['moved'] == 0
+    assert sorted(row[1] for row in delta['inserted']) == sorted(track_keys([track('new'), track('v4', 'renamed')]))
+
+def test_move_sends_only_the_key():
+    old = [track(f'v{i}') for i in range(6)]
+    new = old[1:] + old[:1]
+    delta = round_trip(old, new)
+    assert delta['removed'] == []
+    assert delta['moved'] == 1
+    assert delta['inserted'] == [[5, track_keys(old)[0]]]
+
+def test_repeated_tracks_keep_distinct_keys():
+    old = [track('a'), track('b'), track('a')]
+    assert len(set(track_keys(old))) == 3
+    round_trip(old, [track('a'), track('a'), track('b'), track('a')])
+    round_trip(old, [track('b'), track('a')])
+
+@pytest.mark.parametrize('seed', range(25))
+def test_random_edits_round_trip(seed):
+    rng = random.Random(seed)
+    old = [track(f'v{rng.randrange(40)}') for _ in range(rng.randrange(30))]
+    new = [t for t in old if rng.random() > 0.3]
+    rng.shuffle(new)
+    for i in range(rng.randrange(5)): new.insert(rng.randrange(len(new) + 1), track(f'n{seed}-{i}'))
+    round_trip(old, new)
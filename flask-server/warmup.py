@@ -0,0 +1,58 @@
+import threading, time
+from typing import Callable, Dict, List, Tuple
+
+class Warmup:
+    """Runs named warm-up steps once on a background thread and tracks when the warm path became ready."""
+    def __init__(self):
+        self.started_at = time.time()
+        self.ready_at = None
+        self.steps: Dict[str, dict] = {}
+        self._pending: List[Tuple[str, Callable[[], None]]] = []
+        self._done = threading.Event()
+
+    def add(self, name: str, step: Callable[[], None]) -> None:
+        self._pending.append((name, step))
+        self.steps[name] = {'status': 'pending'}
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name='warmup', daemon=True).start()
+
+    def skip(self) -> None:
+        for name, _ in self._pending: self.steps[name] = {'status': 'skipped'}
+        self._finish()
+
+    def _run(self) -> None:
+        for name, step in self._pending:
+            started = time.perf_counter()
+            try:
+                step()
+                self.steps[name] = {'status': 'ok'}
+            except Exception as e:
+                # A failed step leaves that path cold but must not keep the server out of rotation
+                print("Error: ", e)
+                self.steps[name] = {'status': 'failed', 'error': str(e)}
+            self.steps[name]['seconds'] = round(time.perf_counter() - started, 3)
+        self._finish()
+
+    def _finish(self) -> None:
+        self.ready_at = time.time()
+        self._done.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def time_to_ready(self) -> float:
+        return (self.ready_at or time.time()) - self.started_at
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+    def status(self) -> dict:
+        degraded = any(step['status'] == 'failed' for step in self.steps.values())
+        return {
+            'status': ('degraded' if degraded else 'ready') if self.ready else 'warming',
+            'time_to_ready': round(self.time_to_ready, 3),
+            'steps': self.steps
+        }
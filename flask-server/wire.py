@@ -0,0 +1,61 @@
+import gzip, json
+from typing import Any, Dict, List
+from flask import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPACT_VERSION = 1
+COMPACT_MIMETYPE = 'application/vnd.ytm.compact+json'
+MIN_COMPRESS_SIZE = 512
+
+def dumps(payload: Any) -> bytes:
+    if orjson: return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+def encode_tracks(playlist: List[Dict]) -> Dict:
+    # Tracks become rows of [title, artist index, video_id, thumbnail url, width, height], artists are interned
+    artists, artist_index, tracks = [], {}, []
+    for track in playlist:
+        artist = track['artist']
+        if artist not in artist_index:
+            artist_index[artist] = len(artists)
+            artists.append(artist)
+        thumbnail = track.get('thumbnail') or {}
+        tracks.append([track['title'], artist_index[artist], track['video_id'], thumbnail.get('url'), thumbnail.get('width'), thumbnail.get('height')])
+    return {'artists': artists, 'tracks': tracks}
+
+def encode_compact(response: Any) -> Any:
+    if not isinstance(response, dict) or 'playlist' not in response: return response
+    compact = {'v': COMPACT_VERSION, **encode_tracks(response['playlist'])}
+    # song_info always describes the first row, so only its stream is carried
+    if 'song_info' in response: compact['stream'] = response['song_info']['stream']
+    for key, value in response.items():
+        if key not in ('playlist', 'song_info'): compact[key] = value
+    return compact
+
+def wants_compact(request) -> bool:
+    return request.args.get('format') == 'compact' or COMPACT_MIMETYPE in request.headers.get('Accept', '')
+
+def respond(request, payload: Any) -> Response:
+    compact = wants_compact(request)
+    body = dumps(encode_compact(payload) if compact else payload)
+    response = Response(body, mimetype=COMPACT_MIMETYPE if compact else 'application/json')
+    response.vary.add('Accept-Encoding')
+    if len(body) < MIN_COMPRESS_SIZE: return response
+
+    accepted = request.accept_encodings
+    if brotli and accepted['br']:
+        response.set_data(brotli.compress(body, quality=5))
+        response.content_encoding = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.content_encoding = 'gzip'
+    return response
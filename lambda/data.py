@@ -15,4 +15,5 @@ PLAYBACK_PLAY_CARD = "Playing {}"
 PLAYBACK_NEXT_END = "You have reached the end of the playlist"
 PLAYBACK_PREVIOUS_END = "You have reached the start of the playlist"
 API_CONNECTION_ISSUE = 'Could not connect to api url. Please check the connection to the url or set a new url.'
+STREAM_UNAVAILABLE = "Sorry, that song can't be played right now. Please try again in a moment."
 API_URL_NOT_SET = 'Api url not set. To set api url, say, "Alexa, ask DJ to set api url"'
\ No newline at end of file
@@ -5,9 +5,8 @@ from ask_sdk_core.api_client import DefaultApiClient
 from ask_sdk_core.dispatch_components import AbstractRequestHandler, AbstractExceptionHandler, AbstractResponseInterceptor, AbstractRequestInterceptor
 from ask_sdk_core.handler_input import HandlerInput
 from ask_sdk_model.interfaces.audioplayer import PlayDirective, PlayBehavior, AudioItem, Stream
-from ask_sdk_dynamodb.adapter import DynamoDbAdapter
 from ask_sdk_model import Response
-from mediaUtils import player
+from mediaUtils import player, persistence
 from dataclasses import asdict
 from models import player_models
 
@@ -17,7 +16,7 @@ logger.setLevel(logging.INFO)
 ddb_region = os.environ.get('DYNAMODB_PERSISTENCE_REGION')
 ddb_table_name = os.environ.get('DYNAMODB_PERSISTENCE_TABLE_NAME')
 ddb_resource = boto3.resource('dynamodb', region_name=ddb_region)
-dynamodb_adapter = DynamoDbAdapter(table_name=ddb_table_name, create_table=False, dynamodb_resource=ddb_resource)
+dynamodb_adapter = persistence.CompactDynamoDbAdapter(table_name=ddb_table_name, create_table=False, dynamodb_resource=ddb_resource)
 
 sb = CustomSkillBuilder(persistence_adapter = dynamodb_adapter, api_client=DefaultApiClient())
 
@@ -410,6 +409,9 @@ class PlaybackStartedEventHandler(AbstractRequestHandler):
         logger.info("In PlaybackStartedHandler")
 
         playback_info = player.Attributes.get_playback_info(handler_input)
+        # A loop-time playlist sync moved the track that was playing to the end of the order; put it back in place
+        if playback_info.pop("restore_order", False) and not player.Attributes.get_playback_setting(handler_input).get("shuffle"):
+            player.Attributes.set_play_order(handler_input)
         playback_info["index"] = player.Attributes.get_calculated_index(handler_input)
         playback_info["in_playback_session"] = True
         playback_info["has_previous_playback_session"] = True
@@ -462,6 +464,7 @@ class PlaybackNearlyFinishedEventHandler(AbstractRequestHandler):
 
         persistent_attr = handler_input.attributes_manager.persistent_attributes
         playback_info = player.Attributes.get_playback_info(handler_input)
+        if not playback_info.get("next_stream_enqueued"): player.Controller.extend_playlist(handler_input)
         playlist = player.Attributes.get_playlist(handler_input)
         playback_setting = persistent_attr.get("playback_setting")
 
@@ -476,12 +479,12 @@ class PlaybackNearlyFinishedEventHandler(AbstractRequestHandler):
 
         playback_info["next_stream_enqueued"] = True
 
-        current_metadata = player.Attributes.get_metadata_by_play_order(handler_input, current_index)
-        current_video_id = current_metadata.video_id
+        # The playing track's token, which no longer sits at current_index once a playlist sync reordered the queue
+        current_video_id = player.Attributes.get_token(handler_input)
 
         enqueue_metadata = player.Attributes.get_metadata_by_play_order(handler_input, enqueue_index) # playlist[enqueue_index]
         enqueue_video_id = enqueue_metadata.video_id
-        enqueue_stream, error = player.Api.get_stream(handler_input, enqueue_video_id)
+        enqueue_stream, error = player.Api.get_stream(handler_input, enqueue_video_id, priority='enqueue')
         if error: return handler_input.response_builder.speak(str(error)).response
 
         # Log all attrubutes ----------------------------------
@@ -560,12 +563,18 @@ class LoadPersistenceAttributesRequestInterceptor(AbstractRequestInterceptor):
             # Convert decimals to integers, because of AWS SDK DynamoDB issue
             # https://github.com/boto/boto3/issues/369
             
-            playback_info = player.Attributes.get_user_attributes(handler_input).get("playback_info")
+            user_attr = player.Attributes.get_user_attributes(handler_input)
+            playback_info = user_attr.get("playback_info")
             playback_info["index"] = int(playback_info.get("index", 0))
-            playback_info["play_order"] = [int(i) for i in playback_info.get("play_order", [])]
             playback_info["offset_in_ms"] = int(playback_info.get("offset_in_ms", 0))
+            # Cursors are opaque strings; items saved when they were plain offsets come back as Decimal
+            if playback_info.get("playlist_cursor") is not None: playback_info["playlist_cursor"] = str(playback_info["playlist_cursor"])
+            if playback_info.get("playlist_version") is not None: playback_info["playlist_version"] = int(playback_info["playlist_version"])
 
-            playlist = player.Attributes.get_user_attributes(handler_input).get("playlist")
+            # Compact items decode straight to ints; only items still in the old layout need the full walk
+            if isinstance(user_attr, persistence.UserAttributes): return
+            playback_info["play_order"] = [int(i) for i in playback_info.get("play_order", [])]
+            playlist = user_attr.get("playlist")
             for metadata in playlist:
                 thumbnail = metadata['thumbnail']
                 thumbnail['width'] = int(thumbnail['width'])  # Convert Decimal to int
@@ -573,6 +582,7 @@ class LoadPersistenceAttributesRequestInterceptor(AbstractRequestInterceptor):
 
 class SavePersistenceAttributesResponseInterceptor(AbstractResponseInterceptor):
     def process(self, handler_input: HandlerInput, response):
+        # The adapter diffs against the item as loaded: no write for read-only requests, UpdateItem for small changes
         handler_input.attributes_manager.save_persistent_attributes()
 # ###################################################################
 
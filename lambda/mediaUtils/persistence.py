@@ -0,0 +1,213 @@
+from typing import Dict, List, Optional, Tuple
+from array import array
+from ask_sdk_core.exceptions import PersistenceException
+from ask_sdk_dynamodb.adapter import DynamoDbAdapter
+import copy, json, logging, sys, zlib
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Bump when the layout of the queue or order blobs changes; decode_* refuse versions they don't know
+CODEC_VERSION = 1
+LAZY_KEYS = ('playlist', 'playlist_positions')
+
+def _bytes(blob) -> bytes:
+    # boto3 hands binary attributes back wrapped in boto3.dynamodb.types.Binary
+    return bytes(getattr(blob, 'value', blob))
+
+def _check_version(data: bytes) -> bytes:
+    if not data or data[0] != CODEC_VERSION: raise ValueError(f'Unsupported persistence codec version {data[:1]!r}')
+    return data[1:]
+
+def encode_playlist(playlist: List[Dict]) -> bytes:
+    # Columns instead of one map per track: key names are stored once and artists are interned
+    artists, artist_index = [], {}
+    columns = {'title': [], 'artist': [], 'video_id': [], 'url': [], 'width': [], 'height': [], 'artists': artists}
+    for track in playlist:
+        artist = track['artist']
+        if artist not in artist_index:
+            artist_index[artist] = len(artists)
+            artists.append(artist)
+        thumbnail = track.get('thumbnail') or {}
+        columns['title'].append(track['title'])
+        columns['artist'].append(artist_index[artist])
+        columns['video_id'].append(track['video_id'])
+        columns['url'].append(thumbnail.get('url'))
+        columns['width'].append(int(thumbnail.get('width') or 0))
+        columns['height'].append(int(thumbnail.get('height') or 0))
+    return bytes([CODEC_VERSION]) + zlib.compress(json.dumps(columns, separators=(',', ':')).encode('utf-8'), 9)
+
+def decode_playlist(blob) -> Tuple[List[Dict], Dict[str, int]]:
+    columns = json.loads(zlib.decompress(_check_version(_bytes(blob))))
+    artists, playlist, positions = columns['artists'], [], {}
+    rows = zip(columns['title'], columns['artist'], columns['video_id'], columns['url'], columns['width'], columns['height'])
+    for position, (title, artist, video_id, url, width, height) in enumerate(rows):
+        thumbnail = {'url': url, 'width': width, 'height': height} if url else None
+        playlist.append({'title': title, 'artist': artists[artist], 'video_id': video_id, 'thumbnail': thumbnail})
+        positions.setdefault(video_id, position)
+    return playlist, positions
+
+def encode_order(play_order: List[int], inverse: Optional[List[int]]) -> bytes:
+    # Little endian uint32: the play_order length, the play_order, then its inverse when it is current
+    values = array('I', [len(play_order)] + [int(i) for i in play_order])
+    if inverse is not None and len(inverse) == len(play_order): values.extend(int(i) for i in inverse)
+    if sys.byteorder == 'big': values.byteswap()
+    return bytes([CODEC_VERSION]) + values.tobytes()
+
+def decode_order(blob) -> Tuple[List[int], Optional[List[int]]]:
+    values = array('I')
+    values.frombytes(_check_version(_bytes(blob)))
+    if sys.byteorder == 'big': values.byteswap()
+    values = values.tolist()
+    length = values[0]
+    return values[1:length + 1], values[length + 1:] or None
+
+
+class UserAttributes(dict):
+    """A user's persisted attributes whose queue blob is only decoded when the playlist is first read."""
+    def __init__(self, attributes: Dict, queue=None):
+        super().__init__(attributes)
+        self.queue = queue
+        self.stored_queue = queue
+        self._loaded = None
+
+    def decode(self) -> None:
+        if self.queue is None: return
+        queue, self.queue = self.queue, None
+        # A playlist replaced before it was ever read makes the stored one irrelevant
+        if dict.__contains__(self, 'playlist'): return
+        playlist, positions = decode_playlist(queue)
+        dict.__setitem__(self, 'playlist', playlist)
+        dict.__setitem__(self, 'playlist_positions', positions)
+        self._loaded = list(playlist)
+
+    def queue_unchanged(self) -> bool:
+        # Never read, or read and still holding the very track dicts that were decoded (a pointer compare per track)
+        if not dict.__contains__(self, 'playlist'): return self.stored_queue is not None
+        return self._loaded is not None and dict.__getitem__(self, 'playlist') == self._loaded
+
+    def __missing__(self, key):
+        if key in LAZY_KEYS and self.queue is not None:
+            self.decode()
+            return dict.__getitem__(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in LAZY_KEYS: self.decode()
+        return super().get(key, default)
+
+    def __contains__(self, key) -> bool:
+        if key in LAZY_KEYS: self.decode()
+        return super().__contains__(key)
+
+    def __repr__(self) -> str:
+        return f'{dict.__repr__(self)[:-1]}, queue=<{len(_bytes(self.queue))} bytes>}}' if self.queue is not None else dict.__repr__(self)
+
+
+def encode_user(user_attr: Dict) -> Dict:
+    stored = {key: value for key, value in dict.items(user_attr) if key not in LAZY_KEYS and key != 'playback_info'}
+    playback_info = dict(user_attr.get('playback_info') or {})
+    play_order, inverse = playback_info.pop('play_order', []), playback_info.pop('play_order_inverse', None)
+    stored['playback_info'] = playback_info
+    stored['order'] = encode_order(play_order, inverse)
+    # A queue that wasn't replaced or appended to goes back exactly as it was loaded, without re-encoding
+    untouched = isinstance(user_attr, UserAttributes) and user_attr.queue_unchanged()
+    stored['queue'] = _bytes(user_attr.stored_queue) if untouched else encode_playlist(dict.get(user_attr, 'playlist') or [])
+    stored['codec'] = CODEC_VERSION
+    return stored
+
+def decode_user(stored: Dict) -> Dict:
+    # Items written before the codec existed come back unchanged and are migrated on their next save
+    if 'codec' not in stored: return stored
+    stored = dict(stored)
+    stored.pop('codec')
+    queue = stored.pop('queue')
+    play_order, inverse = decode_order(stored.pop('order'))
+    playback_info = stored['playback_info'] = dict(stored.get('playback_info') or {})
+    playback_info['play_order'] = play_order
+    if inverse is not None: playback_info['play_order_inverse'] = inverse
+    return UserAttributes(stored, queue)
+
+
+def diff_user(old: Dict, new: Dict) -> Tuple[Dict[Tuple[str, ...], object], List[Tuple[str, ...]]]:
+    # Paths to SET and REMOVE to turn the stored user entry into the new one; playback_info is diffed per field
+    sets, removes = {}, []
+    for key in new.keys() | old.keys():
+        if key == 'playback_info' and isinstance(old.get(key), dict) and isinstance(new.get(key), dict):
+            for field in new[key].keys() | old[key].keys():
+                if field not in new[key]: removes.append((key, field))
+                elif field not in old[key] or old[key][field] != new[key][field]: sets[(key, field)] = new[key][field]
+        elif key not in new: removes.append((key,))
+        elif key not in old or old[key] != new[key]: sets[(key,)] = new[key]
+    return sets, removes
+
+
+class StoredAttributes(dict):
+    """Persistent attributes that remember the item as loaded, so saving can write only what changed."""
+    def __init__(self, attributes: Dict, snapshot: Dict):
+        super().__init__(attributes)
+        self.snapshot = snapshot
+
+
+class CompactDynamoDbAdapter(DynamoDbAdapter):
+    """DynamoDbAdapter storing each user's queue as versioned, compressed columns instead of nested maps.
+
+    Saves are skipped when nothing changed and become an UpdateItem on the changed paths when the item already
+    exists in the compact layout; new and old layout items are written whole."""
+    def get_attributes(self, request_envelope) -> Dict:
+        attributes = super().get_attributes(request_envelope)
+        snapshot = {}
+        for key, value in attributes.items():
+            if isinstance(value, dict) and 'codec' in value:
+                snapshot[key] = {k: _bytes(v) if k in ('queue', 'order') else copy.deepcopy(v) for k, v in value.items()}
+        decoded = {key: decode_user(value) if isinstance(value, dict) else value for key, value in attributes.items()}
+        return StoredAttributes(decoded, snapshot if attributes else None)
+
+    def save_attributes(self, request_envelope, attributes: Dict) -> None:
+        encoded = {key: encode_user(value) if isinstance(value, dict) and 'playback_info' in value else value for key, value in attributes.items()}
+        snapshot = getattr(attributes, 'snapshot', None)
+        # Nothing loaded to diff against (new user, old layout, or attributes replaced wholesale): write the whole item
+        if snapshot is None or encoded.keys() != snapshot.keys():
+            super().save_attributes(request_envelope, encoded)
+            return
+
+        sets, removes = {}, []
+        for key, value in encoded.items():
+            user_sets, user_removes = diff_user(snapshot[key], value)
+            sets.update({(key,) + path: v for path, v in user_sets.items()})
+            removes.extend((key,) + path for path in user_removes)
+        if not sets and not removes: return
+        self.update_attributes(request_envelope, sets, removes)
+
+    def update_attributes(self, request_envelope, sets: Dict[Tuple[str, ...], object], removes: List[Tuple[str, ...]]) -> None:
+        names, values = {}, {}
+
+        def path(keys: Tuple[str, ...]) -> str:
+            aliases = []
+            for key in (self.attribute_name,) + keys:
+                if key not in names: names[key] = f'#n{len(names)}'
+                aliases.append(names[key])
+            return '.'.join(aliases)
+
+        clauses = []
+        if sets:
+            assignments = []
+            for keys, value in sets.items():
+                values[f':v{len(values)}'] = value
+                assignments.append(f'{path(keys)} = :v{len(values) - 1}')
+            clauses.append('SET ' + ', '.join(assignments))
+        if removes: clauses.append('REMOVE ' + ', '.join(path(keys) for keys in removes))
+        logger.info(f'Partial save -> {sorted(".".join(keys) for keys in list(sets) + removes)}')
+
+        kwargs = {
+            'Key': {self.partition_key_name: self.partition_keygen(request_envelope)},
+            'UpdateExpression': ' '.join(clauses),
+            'ExpressionAttributeNames': {alias: key for key, alias in names.items()}
+        }
+        if values: kwargs['ExpressionAttributeValues'] = values
+        try:
+            self.dynamodb.Table(self.table_name).update_item(**kwargs)
+        except Exception as e:
+            raise PersistenceException(
+                "Failed to update attributes in DynamoDb table. Exception of "
+                "type {} occurred: {}".format(type(e).__name__, str(e)))
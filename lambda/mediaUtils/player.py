@@ -1,4 +1,5 @@
 from typing import Dict, List, Tuple
+from collections.abc import Sequence
 from ask_sdk_model import Request, Response
 from ask_sdk_model.interfaces.audioplayer import PlayDirective, PlayBehavior, AudioItem, Stream, AudioItemMetadata, StopDirective
 from ask_sdk_core.handler_input import HandlerInput
@@ -9,11 +10,14 @@ from ask_sdk_model.interfaces import display
 from dacite import from_dict
 from dataclasses import asdict
 from models import player_models
-import re
+from mediaUtils import sync
+import re, hashlib, time
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 http = urllib3.PoolManager()
+PLAYLIST_WINDOW_SIZE = 100
+COMPACT_HEADERS = {'Accept-Encoding': 'gzip'}
 
 def send_progressive_response(handler_input: HandlerInput, message: str):
     request_id_holder = handler_input.request_envelope.request.request_id
@@ -35,6 +39,24 @@ def get_similarity(x: str, y: str):
     return intersection_cardinality/float(union_cardinality)
 
 
+class PlaylistView(Sequence):
+    """Read only, typed view over the stored playlist dicts; each Metadata is only built when first accessed."""
+    def __init__(self, raw: List[Dict]):
+        self.raw = raw
+        self._items: Dict[int, player_models.Metadata] = {}
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice): return [self[i] for i in range(*index.indices(len(self.raw)))]
+        if index < 0: index += len(self.raw)
+        if not 0 <= index < len(self.raw): raise IndexError('playlist index out of range')
+        item = self._items.get(index)
+        if item is None: item = self._items[index] = from_dict(player_models.Metadata, self.raw[index])
+        return item
+
+
 class Attributes:
     @staticmethod
     def log_attributes(handler_input: HandlerInput):
@@ -46,6 +68,17 @@ class Attributes:
         user_id = handler_input.request_envelope.context.system.user.user_id
         return user_id
 
+    @staticmethod
+    def get_user_key(handler_input: HandlerInput) -> str:
+        # Short opaque key so the server can tell users apart without seeing the alexa user id
+        return hashlib.sha1(Attributes.get_user_id(handler_input).encode()).hexdigest()[:16]
+
+    @staticmethod
+    def is_stream_url_fresh(url: str, margin: int = 120) -> bool:
+        # googlevideo urls carry their expiry; relayed or unknown urls are assumed fresh
+        match = re.search(r'[?&/]expire[=/](\d+)', url or '')
+        return bool(url) and (not match or int(match.group(1)) - time.time() > margin)
+
     @staticmethod
     def get_user_attributes(handler_input: HandlerInput) -> Dict:
         persistent_attr = handler_input.attributes_manager.persistent_attributes
@@ -65,35 +98,91 @@ class Attributes:
         return playback_setting
 
     @staticmethod
-    def get_playlist(handler_input: HandlerInput) -> List[player_models.Metadata]:
-        user_attr = Attributes.get_user_attributes(handler_input)
-        playlist = [from_dict(player_models.Metadata, i) for i in user_attr.get('playlist')]
-        return playlist
+    def get_playlist(handler_input: HandlerInput) -> PlaylistView:
+        # One view per request, so every handler step shares the Metadata already built
+        raw = Attributes.get_user_attributes(handler_input).get('playlist')
+        request_attr = handler_input.attributes_manager.request_attributes
+        view = request_attr.get('playlist_view')
+        if view is None or view.raw is not raw: view = request_attr['playlist_view'] = PlaylistView(raw)
+        return view
     
     @staticmethod
     def set_playlist(handler_input: HandlerInput, playlist: List[player_models.Metadata]) -> None:
         user_attr = Attributes.get_user_attributes(handler_input)
         user_attr['playlist'] = [asdict(i) for i in playlist]
+        user_attr['playlist_positions'] = Attributes.index_playlist(user_attr['playlist'])
+        handler_input.attributes_manager.request_attributes.pop('playlist_view', None)
+
+    @staticmethod
+    def append_playlist(handler_input: HandlerInput, tracks: List[player_models.Metadata]) -> None:
+        # Appends in place; the cached view stays valid since existing positions don't move
+        user_attr = Attributes.get_user_attributes(handler_input)
+        positions = Attributes.get_playlist_positions(handler_input)
+        for track in tracks:
+            positions.setdefault(track.video_id, len(user_attr['playlist']))
+            user_attr['playlist'].append(asdict(track))
+
+    @staticmethod
+    def index_playlist(playlist: List[Dict]) -> Dict[str, int]:
+        # video_id -> first position, matching what list.index() used to return for repeated tracks
+        positions = {}
+        for position, track in enumerate(playlist): positions.setdefault(track['video_id'], position)
+        return positions
+
+    @staticmethod
+    def get_playlist_positions(handler_input: HandlerInput) -> Dict[str, int]:
+        user_attr = Attributes.get_user_attributes(handler_input)
+        positions = user_attr.get('playlist_positions')
+        # Items saved before positions were kept get them built once here
+        if positions is None: positions = user_attr['playlist_positions'] = Attributes.index_playlist(user_attr.get('playlist'))
+        return positions
 
     @staticmethod
     def get_play_order(handler_input: HandlerInput):
         playback_info = Attributes.get_playback_info(handler_input)
         return playback_info['play_order']
 
+    @staticmethod
+    def assign_play_order(handler_input: HandlerInput, play_order: List[int]) -> None:
+        # play_order_inverse[playlist index] -> position in play_order, kept next to it so lookups never scan
+        playback_info = Attributes.get_playback_info(handler_input)
+        inverse = [0] * len(play_order)
+        for index, playlist_index in enumerate(play_order): inverse[playlist_index] = index
+        playback_info['play_order'] = play_order
+        playback_info['play_order_inverse'] = inverse
+
+    @staticmethod
+    def extend_play_order(handler_input: HandlerInput, new_indexes: List[int]) -> None:
+        # new_indexes are the playlist positions just appended, in the order they should play
+        playback_info = Attributes.get_playback_info(handler_input)
+        inverse = Attributes.get_play_order_inverse(handler_input)
+        start = len(playback_info['play_order'])
+        playback_info['play_order'] = playback_info['play_order'] + new_indexes
+        inverse.extend([0] * len(new_indexes))
+        for offset, playlist_index in enumerate(new_indexes): inverse[playlist_index] = start + offset
+
+    @staticmethod
+    def get_play_order_inverse(handler_input: HandlerInput) -> List[int]:
+        playback_info = Attributes.get_playback_info(handler_input)
+        inverse = playback_info.get('play_order_inverse')
+        if inverse is None or len(inverse) != len(playback_info['play_order']):
+            Attributes.assign_play_order(handler_input, playback_info['play_order'])
+            inverse = playback_info['play_order_inverse']
+        return inverse
+
     @staticmethod
     def set_play_order(handler_input: HandlerInput) -> None:
         playback_setting = Attributes.get_playback_setting(handler_input)
-        playback_info = Attributes.get_playback_info(handler_input)
         playlist = Attributes.get_playlist(handler_input)
         shuffle = playback_setting['shuffle']
 
         if shuffle:
             shuffled_play_order = Attributes.shuffle_order(handler_input)
-            playback_info['play_order'] = shuffled_play_order
+            Attributes.assign_play_order(handler_input, shuffled_play_order)
             shuffled_index_adjusted_play_order = Attributes.rotate_to_match_index(handler_input)
-            playback_info["play_order"] = shuffled_index_adjusted_play_order
+            Attributes.assign_play_order(handler_input, shuffled_index_adjusted_play_order)
         else:
-            playback_info["play_order"] = [l for l in range(0, len(playlist))]
+            Attributes.assign_play_order(handler_input, [l for l in range(0, len(playlist))])
 
     @staticmethod
     def get_from_saved_playlists(handler_input: HandlerInput, playlist_name: str) -> player_models.Playlist:
@@ -121,7 +210,7 @@ class Attributes:
 
     @staticmethod
     def shuffle_order(handler_input: HandlerInput) -> List[int]:
-        play_order = [l for l in range(0, len(Attributes.get_playlist(handler_input)))]
+        play_order = [l for l in range(0, len(Attributes.get_user_attributes(handler_input).get('playlist')))]
         random.shuffle(play_order)
         return play_order
     
@@ -130,7 +219,7 @@ class Attributes:
         playback_info = Attributes.get_playback_info(handler_input)
         play_order = playback_info['play_order']
         current_index = playback_info['index']
-        diff = play_order.index(current_index)-current_index
+        diff = int(Attributes.get_play_order_inverse(handler_input)[current_index])-current_index
         return play_order[diff:]+play_order[:diff]
     
     @staticmethod
@@ -177,11 +266,9 @@ class Attributes:
     @staticmethod
     def get_calculated_index(handler_input: HandlerInput) -> int:
         current_video_id = handler_input.request_envelope.request.token
-        playlist = Attributes.get_playlist(handler_input)
-        play_order = Attributes.get_play_order(handler_input)
-        playlist_tokens = [i.video_id for i in playlist]
-        playlist_index = playlist_tokens.index(current_video_id)
-        index = play_order.index(playlist_index)
+        # Both maps may still hold dynamodb Decimals; only the two entries read here get converted
+        playlist_index = int(Attributes.get_playlist_positions(handler_input)[current_video_id])
+        index = int(Attributes.get_play_order_inverse(handler_input)[playlist_index])
         return index
     
     @staticmethod
@@ -193,15 +280,30 @@ class Attributes:
 
 
 class Api:
+    @staticmethod
+    def decode_tracks(payload: Dict) -> List[player_models.Metadata]:
+        # Compact rows are [title, artist index, video_id, thumbnail url, width, height]
+        artists = payload['artists']
+        return [
+            player_models.Metadata(title, artists[artist], video_id, player_models.Thumbnail(url, width, height) if url else None)
+            for title, artist, video_id, url, width, height in payload['tracks']
+        ]
+
+    @staticmethod
+    def decode_song_info_list(payload: Dict) -> player_models.SongInfoList:
+        playlist = Api.decode_tracks(payload)
+        song_info = player_models.SongInfo(playlist[0], player_models.Stream(**s) if (s := payload.get('stream')) else None)
+        return player_models.SongInfoList(song_info, playlist, payload.get('next_cursor'), payload.get('version'))
+
     @staticmethod
     def find_stream_list(handler_input: HandlerInput, query: str, filter: player_models.Filter) -> Tuple[player_models.SongInfoList, Exception]:
         api_url, error = Attributes.get_api_url(handler_input)
         if error: return None, error
-        url = f"{api_url}/find_stream_list/?query={query}&filter={filter.value}"
-        response = http.request("GET", url)
+        url = f"{api_url}/find_stream_list/?query={query}&filter={filter.value}&format=compact&user={Attributes.get_user_key(handler_input)}"
+        response = http.request("GET", url, headers=COMPACT_HEADERS)
         if response.status == 200: 
             song_info_list = json.loads(response.data.decode("utf-8"))
-            return from_dict(player_models.SongInfoList, song_info_list), None
+            return Api.decode_song_info_list(song_info_list), None
         else: 
             return None, Exception(data.API_CONNECTION_ISSUE)
 
@@ -209,21 +311,54 @@ class Api:
     def stream_playlist(handler_input: HandlerInput, playlist_id: str) -> Tuple[player_models.SongInfoList, Exception]:
         api_url, error = Attributes.get_api_url(handler_input)
         if error: return None, error
-        url = f"{api_url}/stream_playlist/?id={playlist_id}"
-        response = http.request("GET", url)
+        url = f"{api_url}/stream_playlist/?id={playlist_id}&window={PLAYLIST_WINDOW_SIZE}&format=compact&user={Attributes.get_user_key(handler_input)}"
+        response = http.request("GET", url, headers=COMPACT_HEADERS)
         if response.status == 200: 
             song_info_list = json.loads(response.data.decode("utf-8"))
-            return from_dict(player_models.SongInfoList, song_info_list), None
+            return Api.decode_song_info_list(song_info_list), None
         else: return None, Exception(data.API_CONNECTION_ISSUE)
         
     @staticmethod
-    def get_stream(handler_input: HandlerInput, video_id: str) -> Tuple[player_models.Stream, None]:
+    def get_playlist_window(handler_input: HandlerInput, playlist_id: str, cursor: str, after: str = None) -> Tuple[player_models.PlaylistWindow, Exception]:
+        api_url, error = Attributes.get_api_url(handler_input)
+        if error: return None, error
+        url = f"{api_url}/playlist_window/?id={playlist_id}&cursor={cursor}&size={PLAYLIST_WINDOW_SIZE}&format=compact"
+        # Lets the server continue a changed playlist right after the last track loaded here
+        if after: url += f"&after={after}"
+        response = http.request("GET", url, headers=COMPACT_HEADERS)
+        if response.status == 200:
+            response_json = json.loads(response.data.decode("utf-8"))
+            if not response_json: return None, None
+            return player_models.PlaylistWindow(Api.decode_tracks(response_json), response_json.get('next_cursor'), response_json.get('version'), response_json.get('stale', False)), None
+        else: return None, Exception(data.API_CONNECTION_ISSUE)
+
+    @staticmethod
+    def get_playlist_delta(handler_input: HandlerInput, playlist_id: str, since: int = None) -> Tuple[player_models.PlaylistDelta, Exception]:
+        api_url, error = Attributes.get_api_url(handler_input)
+        if error: return None, error
+        url = f"{api_url}/playlist_delta/?id={playlist_id}&format=compact"
+        if since: url += f"&since={since}"
+        response = http.request("GET", url, headers=COMPACT_HEADERS)
+        if response.status == 200:
+            response_json = json.loads(response.data.decode("utf-8"))
+            if not response_json: return None, None
+            version = response_json['version']
+            if response_json.get('unchanged'): return player_models.PlaylistDelta(version, unchanged=True), None
+            if 'tracks' in response_json: return player_models.PlaylistDelta(version, playlist=Api.decode_tracks(response_json)), None
+            return player_models.PlaylistDelta(version, delta=response_json), None
+        else: return None, Exception(data.API_CONNECTION_ISSUE)
+
+    @staticmethod
+    def get_stream(handler_input: HandlerInput, video_id: str, priority: str = None) -> Tuple[player_models.Stream, None]:
         api_url, error = Attributes.get_api_url(handler_input)
         if error: return None, error
-        url = f"{api_url}/get_stream/?video_id={video_id}"
+        url = f"{api_url}/get_stream/?video_id={video_id}&user={Attributes.get_user_key(handler_input)}"
+        if priority: url += f"&priority={priority}"
         response = http.request("GET", url)
         if response.status == 200: 
             response_json = json.loads(response.data.decode("utf-8"))
+            # A null body means extraction failed or found nothing for this video
+            if not response_json: return None, Exception(data.STREAM_UNAVAILABLE)
             stream = from_dict(player_models.Stream, response_json)
             player_info = Attributes.get_playback_info(handler_input)
             player_info['stream_url'] = stream.audio_url
@@ -257,22 +392,115 @@ class Controller:
             playlist = song_info_list.playlist
             song_info = song_info_list.song_info
         else:
-            song_info_list, error = Api.stream_playlist(handler_input, playlist_id)
-            if error: return handler_input.response_builder.speak(str(error)).response
+            song_info_list = Controller.reopen_playlist(handler_input, playlist_id)
+            if song_info_list is None:
+                song_info_list, error = Api.stream_playlist(handler_input, playlist_id)
+                if error: return handler_input.response_builder.speak(str(error)).response
             playlist = song_info_list.playlist
             song_info = song_info_list.song_info
 
+        if song_info.stream is None:
+            # The first stream missed the server's deadline; ask for it on its own before giving up
+            stream, error = Api.get_stream(handler_input, song_info.metadata.video_id)
+            if error: return handler_input.response_builder.speak(str(error)).response
+            song_info = player_models.SongInfo(song_info.metadata, stream)
+
         user_attr = Attributes.get_user_attributes(handler_input)
         Attributes.set_playlist(handler_input, playlist)
         user_attr['playback_info'] = {
             'index': 0,
             'offset_in_ms': 0,
             'play_order': [l for l in range(0, len(playlist))],
-            'stream_url': song_info.stream.audio_url
+            'stream_url': song_info.stream.audio_url,
+            'playlist_id': playlist_id,
+            'playlist_cursor': song_info_list.next_cursor,
+            'playlist_version': song_info_list.version
         }
         Attributes.set_play_order(handler_input)
         return Controller.play(handler_input, song_info, is_playback)
 
+    @staticmethod
+    def extend_playlist(handler_input: HandlerInput) -> None:
+        # Windowed playlists: pull the next window once playback reaches the last loaded track
+        playback_info = Attributes.get_playback_info(handler_input)
+        if not playback_info.get('playlist_id'): return
+
+        playlist = Attributes.get_playlist(handler_input)
+        if playback_info.get('index') + 1 < len(playlist): return
+
+        cursor = playback_info.get('playlist_cursor')
+        if cursor is None: return Controller.sync_playlist(handler_input)
+
+        window, error = Api.get_playlist_window(handler_input, playback_info['playlist_id'], cursor, playlist[-1].video_id)
+        if error or not window: return
+        new_indexes = [l for l in range(len(playlist), len(playlist) + len(window.playlist))]
+        if Attributes.get_playback_setting(handler_input).get('shuffle'): random.shuffle(new_indexes)
+
+        Attributes.append_playlist(handler_input, window.playlist)
+        Attributes.extend_play_order(handler_input, new_indexes)
+        playback_info['playlist_cursor'] = window.next_cursor
+        # After a stale window the queue mixes two versions; 0 stays until it is replaced, so the next delta asks for the whole playlist
+        if window.stale: playback_info['playlist_version'] = 0
+        elif window.version is not None and playback_info.get('playlist_version') != 0: playback_info['playlist_version'] = window.version
+
+    @staticmethod
+    def get_playlist_changes(handler_input: HandlerInput, playlist_id: str, since: int) -> Tuple[List[player_models.Metadata], int]:
+        # (None, version) when nothing changed since `since`, (playlist, version) when something did, (None, None) on errors
+        delta, error = Api.get_playlist_delta(handler_input, playlist_id, since)
+        if error or not delta: return None, None
+        if delta.unchanged: return None, delta.version
+        if delta.playlist is not None: return delta.playlist, delta.version
+        user_attr = Attributes.get_user_attributes(handler_input)
+        try:
+            return [from_dict(player_models.Metadata, track) for track in sync.apply_delta(user_attr['playlist'], delta.delta)], delta.version
+        except KeyError:
+            # The stored queue isn't the snapshot the delta is against: take the whole playlist instead
+            delta, error = Api.get_playlist_delta(handler_input, playlist_id)
+            if error or not delta or delta.playlist is None: return None, None
+            return delta.playlist, delta.version
+
+    @staticmethod
+    def reopen_playlist(handler_input: HandlerInput, playlist_id: str) -> player_models.SongInfoList:
+        # The playlist is already fully loaded here: ask only for what changed instead of paging it in again
+        playback_info = Attributes.get_playback_info(handler_input)
+        since = playback_info.get('playlist_version')
+        if playback_info.get('playlist_id') != playlist_id or since is None or playback_info.get('playlist_cursor') is not None: return None
+
+        playlist, version = Controller.get_playlist_changes(handler_input, playlist_id, since)
+        if version is None: return None
+        if playlist is None: playlist = Attributes.get_playlist(handler_input)[:]
+        if not playlist: return None
+        stream, error = Api.get_stream(handler_input, playlist[0].video_id)
+        if error: return None
+        return player_models.SongInfoList(player_models.SongInfo(playlist[0], stream), playlist, None, version)
+
+    @staticmethod
+    def sync_playlist(handler_input: HandlerInput) -> None:
+        # A fully loaded playlist about to loop picks up what changed upstream since its version
+        playback_info = Attributes.get_playback_info(handler_input)
+        since = playback_info.get('playlist_version')
+        if since is None or not Attributes.get_playback_setting(handler_input).get('loop'): return
+
+        playlist, version = Controller.get_playlist_changes(handler_input, playback_info['playlist_id'], since)
+        if not playlist: return
+
+        # The playing track stays addressable for resume, previous and now playing as the last entry of the new order,
+        # so the next track is the new first one; a track removed upstream is kept at the end of the queue for that
+        current = Attributes.get_metadata_by_play_order(handler_input)
+        position = next((i for i, track in enumerate(playlist) if track.video_id == current.video_id), None)
+        if position is None:
+            playlist = playlist + [current]
+            position = len(playlist) - 1
+        Attributes.set_playlist(handler_input, playlist)
+        others = [l for l in range(0, len(playlist)) if l != position]
+        shuffle = Attributes.get_playback_setting(handler_input).get('shuffle')
+        if shuffle: random.shuffle(others)
+        Attributes.assign_play_order(handler_input, others + [position])
+        playback_info['index'] = len(playlist) - 1
+        playback_info['playlist_version'] = version
+        # In order, the moved track goes back to its place once the next one starts
+        if not shuffle: playback_info['restore_order'] = True
+
     @staticmethod
     def play(
         handler_input: HandlerInput, 
@@ -325,7 +553,7 @@ class Controller:
         playback_info["next_stream_enqueued"] = False
 
         metadata = Attributes.get_metadata_by_play_order(handler_input)
-        if playback_info.get('stream_url') and metadata: stream = player_models.Stream(playback_info.get('stream_url'))
+        if metadata and Attributes.is_stream_url_fresh(playback_info.get('stream_url')): stream = player_models.Stream(playback_info.get('stream_url'))
         else: 
             stream, error = Api.get_stream(handler_input, metadata.video_id)
             if error: return handler_input.response_builder.speak(str(error)).response
@@ -335,6 +563,7 @@ class Controller:
 
     @staticmethod
     def play_next(handler_input: HandlerInput, is_playback=False) -> Response:
+        Controller.extend_playlist(handler_input)
         playlist = Attributes.get_playlist(handler_input)
         playback_info = Attributes.get_playback_info(handler_input)
         playback_setting = Attributes.get_playback_setting(handler_input)
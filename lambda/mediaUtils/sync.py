@@ -0,0 +1,28 @@
+from typing import Dict, List
+import hashlib
+
+# Mirrors flask-server/sync.py: deltas name tracks by these keys, so both sides must derive them the same way
+
+def track_hash(track: Dict) -> str:
+    thumbnail = track.get('thumbnail') or {}
+    content = '\x1f'.join([track['video_id'], track['title'], track['artist'], thumbnail.get('url') or ''])
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=6).hexdigest()
+
+def track_keys(playlist: List[Dict]) -> List[str]:
+    seen, keys = {}, []
+    for track in playlist:
+        digest = track_hash(track)
+        seen[digest] = seen.get(digest, 0) + 1
+        keys.append(digest if seen[digest] == 1 else f'{digest}.{seen[digest]}')
+    return keys
+
+def apply_delta(old_playlist: List[Dict], delta: Dict) -> List[Dict]:
+    # Raises KeyError when old_playlist isn't the snapshot the delta was computed from
+    by_key = dict(zip(track_keys(old_playlist), old_playlist))
+    moved = {row[1] for row in delta['inserted'] if len(row) == 2}
+    drop = set(delta['removed']) | moved
+    playlist = [track for key, track in by_key.items() if key not in drop]
+    for row in delta['inserted']:
+        playlist.insert(row[0], row[2] if len(row) == 3 else by_key[row[1]])
+    if len(playlist) != delta['count']: raise KeyError('delta does not apply to this playlist')
+    return playlist
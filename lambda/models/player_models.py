@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Dict, List, Optional
 from enum import Enum
 
 @dataclass
@@ -22,12 +22,32 @@ class Stream:
 @dataclass
 class SongInfo:
     metadata: Metadata
-    stream: Stream
+    # None when the server couldn't resolve the first track's stream in time
+    stream: Optional[Stream]
 
 @dataclass
 class SongInfoList:
     song_info: SongInfo
     playlist: List[Metadata]
+    next_cursor: Optional[str] = None
+    version: Optional[int] = None
+
+@dataclass
+class PlaylistWindow:
+    playlist: List[Metadata]
+    next_cursor: Optional[str] = None
+    version: Optional[int] = None
+    # The playlist changed upstream since the cursor was handed out; the window continues the new version after the
+    # last loaded track, so the queue is no longer exactly that version
+    stale: bool = False
+
+@dataclass
+class PlaylistDelta:
+    version: int
+    unchanged: bool = False
+    # Set when the server sent the whole playlist instead of a delta
+    playlist: Optional[List[Metadata]] = None
+    delta: Optional[Dict] = None
 
 @dataclass
 class Playlist:
@@ -0,0 +1,6 @@
+import os, sys
+
+# Lambda packages import each other from the deployment root (from mediaUtils import ..., from models import ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# ask_sdk_dynamodb builds a boto3 resource at import time; the Lambda runtime always provides a region
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
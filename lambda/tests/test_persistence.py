@@ -0,0 +1,107 @@
+import pytest
+
+pytest.importorskip('ask_sdk_dynamodb')
+from mediaUtils import persistence
+
+def track(i: int, artist: str = 'artist') -> dict:
+    return {'title': f'title {i}', 'artist': artist, 'video_id': f'video{i:06d}', 'thumbnail': {'url': f'https://img/{i}', 'width': 120, 'height': 90}}
+
+def user(playlist: list) -> dict:
+    return {
+        'playback_setting': {'loop': True, 'shuffle': False},
+        'playback_info': {'index': 2, 'offset_in_ms': 1500, 'play_order': list(reversed(range(len(playlist)))), 'playlist_id': 'PL1', 'playlist_cursor': '1.100'},
+        'playlist': playlist,
+        'saved_playlists': {'mix': {'id': 'PL1', 'title': 'Mix'}},
+        'api_url': 'https://example.org'
+    }
+
+def test_user_round_trip():
+    playlist = [track(i, artist=f'artist {i % 3}') for i in range(10)] + [{**track(10), 'thumbnail': None}]
+    original = user(playlist)
+    decoded = persistence.decode_user(persistence.encode_user(original))
+
+    assert isinstance(decoded, persistence.UserAttributes)
+    assert decoded['playlist'] == playlist
+    assert decoded['playlist_positions'] == {t['video_id']: i for i, t in enumerate(playlist)}
+    assert decoded['playback_info'] == original['playback_info']
+    assert decoded['saved_playlists'] == original['saved_playlists']
+
+def test_play_order_inverse_round_trips_only_when_current():
+    original = user([track(i) for i in range(4)])
+    original['playback_info']['play_order_inverse'] = [3, 2, 1, 0]
+    assert persistence.decode_user(persistence.encode_user(original))['playback_info']['play_order_inverse'] == [3, 2, 1, 0]
+    original['playback_info']['play_order_inverse'] = [0, 1]
+    assert 'play_order_inverse' not in persistence.decode_user(persistence.encode_user(original))['playback_info']
+
+def test_playlist_is_decoded_lazily_and_reused_when_untouched():
+    stored = persistence.encode_user(user([track(i) for i in range(5)]))
+    decoded = persistence.decode_user(stored)
+    assert decoded.queue is not None
+    assert persistence.encode_user(decoded)['queue'] == stored['queue']
+
+    decoded['playlist']
+    assert decoded.queue is None
+    assert decoded.queue_unchanged()
+    decoded['playlist'].append(track(5))
+    assert not decoded.queue_unchanged()
+    assert len(persistence.decode_playlist(persistence.encode_user(decoded)['queue'])[0]) == 6
+
+def test_items_from_before_the_codec_pass_through_and_migrate_on_save():
+    legacy = user([track(i) for i in range(3)])
+    assert persistence.decode_user(legacy) is legacy
+    migrated = persistence.encode_user(legacy)
+    assert migrated['codec'] == persistence.CODEC_VERSION
+    assert persistence.decode_user(migrated)['playlist'] == legacy['playlist']
+
+def test_unknown_codec_versions_are_refused():
+    stored = persistence.encode_user(user([track(1)]))
+    stored['queue'] = bytes([persistence.CODEC_VERSION + 1]) + stored['queue'][1:]
+    with pytest.raises(ValueError):
+        persistence.decode_user(stored)['playlist']
+    with pytest.raises(ValueError):
+        persistence.decode_order(b'')
+
+
+def test_diff_of_an_unchanged_user_is_empty():
+    stored = persistence.encode_user(user([track(i) for i in range(3)]))
+    assert persistence.diff_user(stored, persistence.encode_user(persistence.decode_user(stored))) == ({}, [])
+
+def test_diff_sets_changed_playback_fields_one_by_one():
+    stored = persistence.encode_user(user([track(i) for i in range(3)]))
+    decoded = persistence.decode_user(stored)
+    decoded['playback_info']['index'] = 0
+    decoded['playback_info']['in_playback_session'] = True
+    del decoded['playback_info']['playlist_cursor']
+    sets, removes = persistence.diff_user(stored, persistence.encode_user(decoded))
+    assert sets == {('playback_info', 'index'): 0, ('playback_info', 'in_playback_session'): True}
+    assert removes == [('playback_info', 'playlist_cursor')]
+
+def test_diff_replaces_the_queue_and_removes_dropped_keys():
+    stored = persistence.encode_user(user([track(i) for i in range(3)]))
+    decoded = persistence.decode_user(stored)
+    decoded['playlist'] = [track(9)]
+    del decoded['api_url']
+    sets, removes = persistence.diff_user(stored, persistence.encode_user(decoded))
+    assert set(sets) == {('queue',)}
+    assert persistence.decode_playlist(sets[('queue',)])[0] == [track(9)]
+    assert removes == [('api_url',)]
+
+def test_diff_applied_to_the_stored_item_gives_the_new_one():
+    stored = persistence.encode_user(user([track(i) for i in range(4)]))
+    decoded = persistence.decode_user(stored)
+    decoded['playback_setting'] = {'loop': False, 'shuffle': True}
+    decoded['playback_info']['play_order'] = [0, 1, 2, 3]
+    decoded['playlist'].append(track(4))
+    new = persistence.encode_user(decoded)
+
+    sets, removes = persistence.diff_user(stored, new)
+    patched = {key: dict(value) if isinstance(value, dict) else value for key, value in stored.items()}
+    for path, value in sets.items():
+        target = patched
+        for key in path[:-1]: target = target[key]
+        target[path[-1]] = value
+    for path in removes:
+        target = patched
+        for key in path[:-1]: target = target[key]
+        del target[path[-1]]
+    assert patched == new
@@ -0,0 +1,103 @@
+import random
+from decimal import Decimal
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('ask_sdk_core')
+pytest.importorskip('dacite')
+from mediaUtils import player
+from mediaUtils.player import Attributes
+from models import player_models
+
+USER_ID = 'amzn1.ask.account.test'
+
+def track(i: int) -> dict:
+    return {'title': f'title {i}', 'artist': 'artist', 'video_id': f'video{i:06d}', 'thumbnail': {'url': f'https://img/{i}', 'width': 120, 'height': 90}}
+
+def handler(playlist: list, index: int = 0, shuffle: bool = False, token: str = None):
+    """Just the parts of a HandlerInput the Attributes helpers read."""
+    user_attr = {
+        'playback_setting': {'loop': True, 'shuffle': shuffle},
+        'playback_info': {'index': index, 'offset_in_ms': 0, 'play_order': list(range(len(playlist)))},
+        'playlist': playlist,
+        'saved_playlists': {}
+    }
+    return SimpleNamespace(
+        attributes_manager=SimpleNamespace(persistent_attributes={USER_ID: user_attr}, request_attributes={}),
+        request_envelope=SimpleNamespace(context=SimpleNamespace(system=SimpleNamespace(user=SimpleNamespace(user_id=USER_ID))),
+                                         request=SimpleNamespace(token=token))
+    )
+
+def assert_inverse(handler_input) -> None:
+    play_order = Attributes.get_play_order(handler_input)
+    inverse = Attributes.get_play_order_inverse(handler_input)
+    assert sorted(play_order) == list(range(len(play_order)))
+    assert [play_order[int(inverse[i])] for i in range(len(play_order))] == list(range(len(play_order)))
+
+def test_inverse_follows_shuffle_and_rotate():
+    random.seed(7)
+    for index in range(8):
+        handler_input = handler([track(i) for i in range(8)], index=index, shuffle=True)
+        Attributes.set_play_order(handler_input)
+        assert_inverse(handler_input)
+        # The rotation keeps the playing track where the index points
+        assert Attributes.get_play_order(handler_input)[index] == index
+
+def test_inverse_follows_window_extension():
+    random.seed(11)
+    handler_input = handler([track(i) for i in range(5)], index=4, shuffle=True)
+    Attributes.set_play_order(handler_input)
+    for window in ([track(i) for i in range(5, 9)], [track(2), track(9)]):
+        start = len(Attributes.get_playlist(handler_input))
+        new_indexes = list(range(start, start + len(window)))
+        random.shuffle(new_indexes)
+        Attributes.append_playlist(handler_input, [player_models.Metadata(**{**t, 'thumbnail': player_models.Thumbnail(**t['thumbnail'])}) for t in window])
+        Attributes.extend_play_order(handler_input, new_indexes)
+        assert_inverse(handler_input)
+    # A repeated track keeps pointing at its first position
+    assert Attributes.get_playlist_positions(handler_input) == {**{f'video{i:06d}': i for i in range(9)}, 'video000009': 10}
+
+def test_inverse_is_rebuilt_when_missing_or_out_of_date():
+    handler_input = handler([track(i) for i in range(4)])
+    playback_info = Attributes.get_playback_info(handler_input)
+    playback_info['play_order'] = [2, 0, 3, 1]
+    assert_inverse(handler_input)
+    playback_info['play_order'], playback_info['play_order_inverse'] = [1, 0, 2], [0, 1]
+    assert_inverse(handler_input)
+
+def test_legacy_item_with_decimals():
+    # Items saved before the compact layout keep DynamoDB Decimals in the maps the load interceptor doesn't walk
+    playlist = [track(i) for i in range(4)]
+    handler_input = handler(playlist, index=1, shuffle=True, token='video000003')
+    user_attr = Attributes.get_user_attributes(handler_input)
+    user_attr['playback_info']['play_order'] = [2, 3, 0, 1]
+    user_attr['playback_info']['play_order_inverse'] = [Decimal(2), Decimal(3), Decimal(0), Decimal(1)]
+    user_attr['playlist_positions'] = {t['video_id']: Decimal(i) for i, t in enumerate(playlist)}
+
+    index = Attributes.get_calculated_index(handler_input)
+    assert index == 1 and type(index) is int
+    assert Attributes.rotate_to_match_index(handler_input) == [0, 1, 2, 3]
+    Attributes.append_playlist(handler_input, [player_models.Metadata('title 4', 'artist', 'video000004', None)])
+    Attributes.extend_play_order(handler_input, [4])
+    assert_inverse(handler_input)
+    assert Attributes.get_playlist_positions(handler_input)['video000004'] == 4
+
+def test_playlist_view_is_replaced_by_set_playlist():
+    handler_input = handler([track(i) for i in range(3)])
+    view = Attributes.get_playlist(handler_input)
+    first = view[0]
+    assert Attributes.get_playlist(handler_input) is view and view[0] is first
+
+    Attributes.set_playlist(handler_input, [player_models.Metadata('new', 'artist', 'video000100', None)])
+    replaced = Attributes.get_playlist(handler_input)
+    assert replaced is not view
+    assert [t.video_id for t in replaced] == ['video000100']
+
+def test_playlist_view_is_kept_by_append_playlist():
+    handler_input = handler([track(i) for i in range(3)])
+    view = Attributes.get_playlist(handler_input)
+    first = view[0]
+    Attributes.append_playlist(handler_input, [player_models.Metadata('title 3', 'artist', 'video000003', None)])
+    assert Attributes.get_playlist(handler_input) is view
+    assert view[0] is first
+    assert len(view) == 4 and view[-1].video_id == 'video000003'